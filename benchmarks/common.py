@@ -0,0 +1,102 @@
+import os
+from argparse import ArgumentParser
+from asyncio import gather
+from time import perf_counter
+from typing import Awaitable, Callable, List, NamedTuple, Tuple
+
+from OpenSSL.crypto import PKey, X509, TYPE_RSA
+
+from ovpn_bot.certs import CertManager, dump_key, dump_cert_req, dump_cert
+
+
+class Latency(NamedTuple):
+    count: int
+    total: float
+    mean: float
+    p50: float
+    p95: float
+    p99: float
+
+    def __str__(self) -> str:
+        return (f"{self.count / self.total:9.0f} ops/s  "
+                f"mean {self.mean * 1000:7.3f} ms  p50 {self.p50 * 1000:7.3f} ms  "
+                f"p95 {self.p95 * 1000:7.3f} ms  p99 {self.p99 * 1000:7.3f} ms")
+
+
+def add_database_arguments(parser: ArgumentParser):
+    # Defaults follow libpq environment, so local socket or docker-compose port both work
+    parser.add_argument("--host", default=os.environ.get("PGHOST", "localhost"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PGPORT", 5432)))
+    parser.add_argument("--name", default=os.environ.get("PGDATABASE", "postgres"))
+    parser.add_argument("--username", default=os.environ.get("PGUSER", "postgres"))
+    parser.add_argument("--password", default=os.environ.get("PGPASSWORD", ""))
+
+
+def db_config(args, backend: str, pool_size: int):
+    return {
+        "backend": backend,
+        "host": args.host,
+        "port": args.port,
+        "name": args.name,
+        "username": args.username,
+        "password": args.password,
+        "timeout": 60.0,
+        "wait": 30.0,
+        "pool": {"minsize": pool_size, "maxsize": pool_size, "recycle": -1, "idle_lifetime": 300.0},
+    }
+
+
+def generate_key_material(count: int, bits: int = 2048) -> List[Tuple[bytes, bytes, bytes]]:
+    root_pkey = PKey()
+    root_pkey.generate_key(TYPE_RSA, bits)
+    root_cert = X509()
+    subject = root_cert.get_subject()
+    # CertManager copies these fields of root subject into every device certificate
+    subject.countryName = "RU"
+    subject.stateOrProvinceName = "MOSCOW"
+    subject.localityName = "MOSCOW"
+    subject.organizationName = "Automated IM"
+    subject.organizationalUnitName = "Benchmark"
+    subject.emailAddress = "ovpn.bot@automated.im"
+    subject.commonName = "benchmark"
+    root_cert.set_issuer(root_cert.get_subject())
+    root_cert.set_pubkey(root_pkey)
+    root_cert.gmtime_adj_notBefore(0)
+    root_cert.gmtime_adj_notAfter(3600)
+    root_cert.sign(root_pkey, "sha256")
+    cert_manager = CertManager(root_cert, root_cert, root_pkey, b"")
+
+    material = []
+    for serial_number in range(1, count + 1):
+        pkey = cert_manager.create_private_key()
+        cert_req = cert_manager.create_certificate_request(f"benchmark_device_{serial_number}", pkey)
+        cert = cert_manager.sign_certificate_request(cert_req, serial_number)
+        material.append((dump_key(pkey), dump_cert_req(cert_req), dump_cert(cert)))
+    return material
+
+
+async def measure(operation: Callable[[int], Awaitable], iterations: int, concurrency: int) -> Latency:
+    latencies = []
+
+    async def worker(offset: int):
+        for i in range(offset, iterations, concurrency):
+            started = perf_counter()
+            await operation(i)
+            latencies.append(perf_counter() - started)
+
+    started = perf_counter()
+    await gather(*(worker(offset) for offset in range(concurrency)))
+    total = perf_counter() - started
+
+    latencies.sort()
+    return Latency(
+        len(latencies),
+        total,
+        sum(latencies) / len(latencies),
+        latencies[len(latencies) // 2],
+        latencies[int(len(latencies) * 0.95)],
+        latencies[int(len(latencies) * 0.99)])
+
+
+def format_size(size: int) -> str:
+    return f"{size / 1024 / 1024:8.1f} MiB"
@@ -0,0 +1,174 @@
+"""Compares PEM text and DER bytea storage of device key material.
+
+Seeds two scratch tables shaped like "devices" before and after migration 8a1c3e5d7f20,
+reports table and TOAST sizes, latency of fetching a user's devices, bytes transferred
+per row and memory held by fetched Device objects.
+
+Requires a disposable database with migrations applied:
+
+    python -m benchmarks.der_storage --host localhost --port 15432 --rows 100000
+"""
+import tracemalloc
+from argparse import ArgumentParser
+from asyncio import run
+from dataclasses import dataclass
+from datetime import datetime
+from random import Random
+from uuid import UUID
+
+from aiopg import create_pool
+
+from benchmarks.common import add_database_arguments, generate_key_material, measure, format_size
+from ovpn_bot.certs import der_to_pem
+from ovpn_bot.dao import Device
+
+COLUMNS = "id, user_id, name, pkey, cert_req, cert, cert_sn, created_at, removed"
+
+
+# Device model as it was before the migration
+@dataclass
+class PemDevice:
+    id: UUID
+    user_id: int
+    name: str
+    pkey: str
+    cert_req: str
+    cert: str
+    cert_sn: int
+    created_at: datetime
+    removed: bool
+
+
+def create_table_sql(table: str, key_type: str) -> str:
+    return f"""
+        create table bench.{table} (
+            id uuid not null default uuid_generate_v4() primary key,
+            user_id bigint not null,
+            name varchar(64) not null,
+            pkey {key_type} not null,
+            cert_req {key_type} not null,
+            cert {key_type} not null,
+            cert_sn bigint not null,
+            created_at timestamptz not null default current_timestamp,
+            removed boolean not null default false
+        );
+        create index on bench.{table} (user_id) where not removed;
+    """
+
+
+async def seed(cur, rows: int, users: int, material):
+    await cur.execute("drop schema if exists bench cascade")
+    await cur.execute("create schema bench")
+    await cur.execute(create_table_sql("devices_pem", "text"))
+    await cur.execute(create_table_sql("devices_der", "bytea"))
+    await cur.execute("create table bench.material (n integer primary key, pkey bytea, cert_req bytea, cert bytea)")
+    for n, (pkey, cert_req, cert) in enumerate(material):
+        await cur.execute(
+            "insert into bench.material values (%s, %s, %s, %s)",
+            [n, pkey, cert_req, cert])
+    await cur.execute("create table bench.material_pem (n integer primary key, pkey text, cert_req text, cert text)")
+    for n, (pkey, cert_req, cert) in enumerate(material):
+        await cur.execute(
+            "insert into bench.material_pem values (%s, %s, %s, %s)",
+            [n, der_to_pem(pkey, "PRIVATE KEY"), der_to_pem(cert_req, "CERTIFICATE REQUEST"),
+             der_to_pem(cert, "CERTIFICATE")])
+
+    for table, source in (("devices_pem", "material_pem"), ("devices_der", "material")):
+        await cur.execute(
+            f"""
+            insert into bench.{table} (user_id, name, pkey, cert_req, cert, cert_sn)
+            select i %% %s, 'device ' || i, m.pkey, m.cert_req, m.cert, i
+            from generate_series(1, %s) i join bench.{source} m on m.n = i %% %s
+            """,
+            [users, rows, len(material)])
+    await cur.execute("vacuum analyze bench.devices_pem")
+    await cur.execute("vacuum analyze bench.devices_der")
+
+
+async def report_sizes(cur):
+    print("Table sizes")
+    for table in ("devices_pem", "devices_der"):
+        await cur.execute(
+            """
+            select pg_relation_size(c.oid),
+                   coalesce(pg_total_relation_size(nullif(c.reltoastrelid, 0)), 0),
+                   pg_total_relation_size(c.oid)
+            from pg_class c where c.oid = %s::regclass
+            """,
+            [f"bench.{table}"])
+        heap, toast, total = await cur.fetchone()
+        print(f"  {table}: heap {format_size(heap)}  toast {format_size(toast)}  total {format_size(total)}")
+
+
+async def report_fetch(pool, users: int, iterations: int, concurrency: int):
+    print(f"Fetch devices of random user, {iterations} queries with concurrency {concurrency}")
+    for table in ("devices_pem", "devices_der"):
+        random = Random(42)
+        stored, transferred = [], []
+
+        async def fetch(i):
+            async with pool.acquire() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(
+                        f"select {COLUMNS} from bench.{table} where user_id = %s and not removed",
+                        [random.randrange(users)])
+                    for record in await cur.fetchall():
+                        stored.append(sum(len(value) for value in record[3:6]))
+                        # Text protocol sends bytea hex encoded as "\x..."
+                        transferred.append(sum(
+                            2 + 2 * len(value) if isinstance(value, (bytes, memoryview)) else len(value)
+                            for value in record[3:6]))
+
+        latency = await measure(fetch, iterations, concurrency)
+        print(f"  {table}: {latency}")
+        print(f"    key material {sum(stored) / len(stored):6.0f} B/row, "
+              f"{sum(transferred) / len(transferred):6.0f} B/row over text protocol")
+
+
+async def report_memory(cur, rows: int):
+    print(f"Memory held by {rows} fetched devices")
+    for table, model in (("devices_pem", PemDevice), ("devices_der", Device)):
+        await cur.execute(f"select {COLUMNS} from bench.{table} limit %s", [rows])
+        records = await cur.fetchall()
+        tracemalloc.start()
+        snapshot = tracemalloc.take_snapshot()
+        devices = [model(*record) for record in records]
+        size = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(snapshot, "filename"))
+        tracemalloc.stop()
+        print(f"  {table}: {model.__name__} objects {format_size(size)}, {size / len(devices):6.0f} B/device")
+        del devices, records
+
+
+async def main():
+    parser = ArgumentParser(description="PEM vs DER key material storage benchmark")
+    add_database_arguments(parser)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--devices-per-user", type=int, default=6)
+    parser.add_argument("--material", type=int, default=50, help="distinct key pairs to generate")
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--keep", action="store_true", help="keep bench schema after run")
+    args = parser.parse_args()
+    users = max(args.rows // args.devices_per_user, 1)
+
+    print(f"Generating {args.material} key pairs...")
+    material = generate_key_material(args.material)
+
+    async with create_pool(
+            host=args.host, port=args.port, dbname=args.name, user=args.username, password=args.password,
+            minsize=args.concurrency, maxsize=args.concurrency) as pool:
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                print(f"Seeding {args.rows} rows into each table...")
+                await seed(cur, args.rows, users, material)
+                await report_sizes(cur)
+        await report_fetch(pool, users, args.iterations, args.concurrency)
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await report_memory(cur, min(args.rows, 10000))
+                if not args.keep:
+                    await cur.execute("drop schema bench cascade")
+
+
+if __name__ == '__main__':
+    run(main())
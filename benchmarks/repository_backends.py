@@ -0,0 +1,114 @@
+"""Compares AiopgDeviceRepository and AsyncpgDeviceRepository implementations.
+
+Seeds "devices" with benchmark users (ids from --user-base) unless they are already there,
+then runs the same repository calls through both backends and reports throughput and latency.
+
+Requires a disposable database with migrations applied:
+
+    python -m benchmarks.repository_backends --host localhost --port 15432 --rows 100000
+"""
+from argparse import ArgumentParser
+from asyncio import run
+from random import Random
+
+from benchmarks.common import add_database_arguments, db_config, generate_key_material, measure
+from ovpn_bot.service import open_db_pool, create_device_repository
+
+BACKENDS = ("aiopg", "asyncpg")
+SEED_CHUNK = 1000
+
+
+async def seed(repository_config, rows: int, users: int, user_base: int, material_count: int):
+    pool = await open_db_pool(repository_config)
+    try:
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "select count(*) from devices where user_id >= %s and user_id < %s and not removed",
+                    [user_base, user_base + users])
+                (seeded,) = await cur.fetchone()
+                if seeded >= rows:
+                    print(f"Using {seeded} already seeded devices")
+                    return
+
+                print(f"Generating {material_count} key pairs...")
+                material = generate_key_material(material_count)
+                print(f"Seeding {rows} devices...")
+                await cur.execute("create temporary table material (n integer, pkey bytea, cert_req bytea, cert bytea)")
+                for n, (pkey, cert_req, cert) in enumerate(material):
+                    await cur.execute("insert into material values (%s, %s, %s, %s)", [n, pkey, cert_req, cert])
+                # Autocommitted chunks keep per-row stats trigger updates of shared counters short
+                for start in range(seeded + 1, rows + 1, SEED_CHUNK):
+                    await cur.execute(
+                        """
+                        insert into devices (user_id, name, pkey, cert_req, cert, cert_sn)
+                        select %s + i %% %s, 'benchmark ' || i, m.pkey, m.cert_req, m.cert, nextval('certs_sn')
+                        from generate_series(%s, %s) i join material m on m.n = i %% %s
+                        """,
+                        [user_base, users, start, min(start + SEED_CHUNK - 1, rows), len(material)])
+                await cur.execute("analyze devices")
+    finally:
+        pool.close()
+        await pool.wait_closed()
+
+
+async def load_device_keys(repository_config, user_base: int, users: int):
+    pool = await open_db_pool(repository_config)
+    try:
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "select user_id, id from devices where user_id >= %s and user_id < %s and not removed",
+                    [user_base, user_base + users])
+                return await cur.fetchall()
+    finally:
+        pool.close()
+        await pool.wait_closed()
+
+
+async def benchmark_backend(args, backend: str, device_keys, users: int):
+    repository_config = db_config(args, backend, args.concurrency)
+    repository = create_device_repository(repository_config, await open_db_pool(repository_config))
+    random = Random(42)
+
+    def random_user() -> int:
+        return args.user_base + random.randrange(users)
+
+    operations = {
+        "get": lambda i: repository.get(*device_keys[random.randrange(len(device_keys))]),
+        "list": lambda i: repository.list(random_user()),
+        "list_page": lambda i: repository.list_page(random_user(), None, True, 10),
+        "count": lambda i: repository.count(random_user()),
+    }
+    try:
+        # Warm up connections and prepared statements
+        await measure(operations["get"], args.concurrency * 10, args.concurrency)
+        for name, operation in operations.items():
+            print(f"  {backend:8} {name:10} {await measure(operation, args.iterations, args.concurrency)}")
+    finally:
+        await repository.close()
+
+
+async def main():
+    parser = ArgumentParser(description="aiopg vs asyncpg device repository benchmark")
+    add_database_arguments(parser)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--devices-per-user", type=int, default=6)
+    parser.add_argument("--user-base", type=int, default=10 ** 12)
+    parser.add_argument("--material", type=int, default=50, help="distinct key pairs to generate")
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+    users = max(args.rows // args.devices_per_user, 1)
+
+    aiopg_config = db_config(args, "aiopg", 1)
+    await seed(aiopg_config, args.rows, users, args.user_base, args.material)
+    device_keys = await load_device_keys(aiopg_config, args.user_base, users)
+
+    print(f"{args.iterations} calls per operation with concurrency {args.concurrency}")
+    for backend in BACKENDS:
+        await benchmark_backend(args, backend, device_keys, users)
+
+
+if __name__ == '__main__':
+    run(main())
@@ -1,30 +1,64 @@
-import logging
-from asyncio import run
-from logging import basicConfig
+from asyncio import run, get_event_loop, ensure_future
+from contextlib import AsyncExitStack
+from logging import getLogger
+from signal import SIGHUP
 
-from ovpn_bot.bot import create_bot, create_bot_dispatcher, create_storage
+from ovpn_bot.bot import create_bot, create_bot_dispatcher, create_storage, get_users_group
 from ovpn_bot.config import load_config
-from ovpn_bot.service import create_vpn_service
+from ovpn_bot.health import create_health_server
+from ovpn_bot.logs import start_logging, configure_logging
+from ovpn_bot.profiling import create_profiler
+from ovpn_bot.service import create_vpn_service, reload_vpn_service, VPNService
+from ovpn_bot.startup import StartupTimings, gather_fail_fast
+from ovpn_bot.tracing import configure_tracing
+
+log = getLogger(__name__)
+
+
+async def reload(vpn_service: VPNService):
+    try:
+        await reload_vpn_service(vpn_service)
+    except Exception:
+        log.exception("Failed to reload configuration")
 
 
 async def main():
-    basicConfig(
-        level=logging.INFO,
-        format="%(asctime)-15s [%(levelname)-8s] %(name)-20s: %(message)s")
-
-    config = load_config()
-    bot = await create_bot(config)
-    storage = await create_storage(config)
-    async with create_vpn_service(config) as vpn_service:
+    timings = StartupTimings()
+    with timings.phase("config"):
+        config = load_config()
+        configure_logging(config)
+
+    profiler = create_profiler(config)
+    async with create_health_server(config, profiler.routes()) as health, AsyncExitStack() as stack:
+        stack.enter_context(configure_tracing(config))
+
+        async def create_bot_with_group():
+            bot = await timings.timed("bot", create_bot(config))
+            stack.push_async_callback(bot.close)
+            return bot, await timings.timed("users_group", get_users_group(bot, config))
+
+        (bot, users_group), storage, vpn_service = await gather_fail_fast(
+            create_bot_with_group(),
+            timings.timed("storage", create_storage(config)),
+            timings.timed("vpn_service", stack.enter_async_context(create_vpn_service(config, timings))))
+
+        with timings.phase("dispatcher"):
+            dispatcher = await create_bot_dispatcher(bot, storage, vpn_service, users_group, profiler, config)
+
+        timings.report()
+        health.set_ready(vpn_service.check_health)
+        loop = get_event_loop()
+        loop.add_signal_handler(SIGHUP, lambda: ensure_future(reload(vpn_service)))
         try:
-            dispatcher = await create_bot_dispatcher(bot, storage, vpn_service, config)
             await dispatcher.start_polling()
         finally:
-            await bot.close()
+            loop.remove_signal_handler(SIGHUP)
+            health.set_not_ready()
 
 
 if __name__ == '__main__':
-    try:
-        run(main())
-    except KeyboardInterrupt:
-        pass
+    with start_logging():
+        try:
+            run(main())
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,54 @@
+from asyncio import sleep
+from datetime import datetime, timedelta, timezone
+from logging import getLogger
+from typing import Tuple
+
+from ovpn_bot.certs import CERT_LIFETIME
+from ovpn_bot.dao import DeviceRepository
+
+log = getLogger(__name__)
+
+
+class DeviceArchiver:
+    def __init__(
+            self,
+            device_repository: DeviceRepository,
+            retention: int,
+            interval: float,
+            batch_size: int,
+            pause: float
+    ):
+        self.__device_repository = device_repository
+        self.__retention = timedelta(days=retention)
+        self.__interval = interval
+        self.__batch_size = batch_size
+        self.__pause = pause
+        log.info("Device archiver created")
+
+    async def archive(self) -> Tuple[int, int]:
+        now = datetime.now(timezone.utc)
+        # Certificates still valid have to stay in devices to be listed in CRL
+        removed_before = now - self.__retention
+        issued_before = now - timedelta(seconds=CERT_LIFETIME)
+
+        total_rows, total_size = 0, 0
+        while True:
+            rows, size = await self.__device_repository.archive_removed(
+                removed_before, issued_before, self.__batch_size)
+            total_rows += rows
+            total_size += size
+            if rows < self.__batch_size:
+                break
+            await sleep(self.__pause)
+
+        if total_rows:
+            log.info(f"Archived {total_rows} removed devices, {total_size} bytes moved out of devices table")
+        return total_rows, total_size
+
+    async def run(self):
+        while True:
+            try:
+                await self.archive()
+            except Exception:
+                log.exception("Failed to archive removed devices")
+            await sleep(self.__interval)
@@ -0,0 +1,261 @@
+import json
+from asyncio import TimeoutError as AsyncTimeoutError
+from contextlib import asynccontextmanager
+from datetime import datetime
+from logging import getLogger
+from typing import List, Optional, Tuple
+from uuid import UUID
+
+from asyncpg import Pool, Connection, PostgresError, InterfaceError, UniqueViolationError, connect, create_pool
+
+from ovpn_bot.dao import (
+    DeviceRepository, Device, DeviceStats, AuditEvent, DuplicateKeyError, DEVICE_COLUMNS, audit_partition_ddl
+)
+from ovpn_bot.tracing import span, traced
+
+log = getLogger(__name__)
+
+# All queries are static so that asyncpg prepares each of them once per connection
+# and reuses the prepared statement from its cache afterwards.
+NEXT_CERT_SN = "select nextval('certs_sn')"
+
+COUNT = "select active_devices from user_device_stats where user_id = $1"
+
+LIST = f"select {DEVICE_COLUMNS} from devices where user_id = $1 and not removed"
+
+LIST_FIRST_PAGE = f"""
+    select {DEVICE_COLUMNS} from devices
+    where user_id = $1 and not removed
+    order by created_at, id
+    limit $2
+"""
+
+LIST_LAST_PAGE = f"""
+    select {DEVICE_COLUMNS} from devices
+    where user_id = $1 and not removed
+    order by created_at desc, id desc
+    limit $2
+"""
+
+LIST_NEXT_PAGE = f"""
+    select {DEVICE_COLUMNS} from devices
+    where user_id = $1 and not removed
+      and (created_at, id) > (select created_at, id from devices where user_id = $1 and id = $2)
+    order by created_at, id
+    limit $3
+"""
+
+LIST_PREV_PAGE = f"""
+    select {DEVICE_COLUMNS} from devices
+    where user_id = $1 and not removed
+      and (created_at, id) < (select created_at, id from devices where user_id = $1 and id = $2)
+    order by created_at desc, id desc
+    limit $3
+"""
+
+CREATE = f"""
+    insert into devices (user_id, name, pkey, cert_req, cert, cert_sn)
+    values ($1, $2, $3, $4, $5, $6) returning {DEVICE_COLUMNS}
+"""
+
+GET = f"select {DEVICE_COLUMNS} from devices where user_id = $1 and id = $2 and not removed"
+
+REMOVE = f"""
+    update devices set removed = true, removed_at = current_timestamp
+    where user_id = $1 and id = $2 and not removed
+    returning {DEVICE_COLUMNS}
+"""
+
+ARCHIVE_REMOVED = """
+    with moved as (
+        delete from devices
+        where id in (
+            select id from devices
+            where removed
+              and (removed_at < $1 or removed_at is null)
+              and created_at < $2
+            limit $3
+            for update skip locked)
+        returning id, user_id, name, cert, cert_sn, created_at, removed_at, pg_column_size(devices.*) as size
+    ), archived as (
+        insert into devices_archive (id, user_id, name, cert, cert_sn, created_at, removed_at)
+        select id, user_id, name, cert, cert_sn, created_at, removed_at from moved
+    )
+    select count(*), coalesce(sum(size), 0)::bigint from moved
+"""
+
+LIST_AUDIT_EVENTS = """
+    select created_at, user_id, action, device_id, details from audit_events
+    where created_at >= $1 and created_at < $2
+      and ($3::bigint is null or user_id = $3)
+    order by created_at desc
+    limit $4
+"""
+
+# Counters are sharded by user id to avoid a single hot row, so shards are summed up
+STATS_TOTAL = "select coalesce(sum(active_devices), 0), coalesce(sum(active_users), 0) from device_stats"
+
+STATS_DAILY = """
+    select day, sum(created_devices), sum(removed_devices) from device_stats_daily
+    group by day
+    order by day desc
+    limit $1
+"""
+
+STATS_TOP_USERS = "select user_id, active_devices from user_device_stats order by active_devices desc limit $1"
+
+
+# Errors of failed connection attempt, database may still be starting up.
+# Connect timeout is raised as asyncio.TimeoutError which isn't OSError before Python 3.11
+CONNECTION_ERRORS = (OSError, AsyncTimeoutError, PostgresError, InterfaceError)
+
+
+def connection_kwargs(db_config):
+    return dict(
+        host=db_config["host"],
+        port=db_config["port"],
+        database=db_config["name"],
+        user=db_config["username"],
+        password=db_config["password"],
+        timeout=db_config["timeout"])
+
+
+async def probe(db_config):
+    conn = await connect(**connection_kwargs(db_config))
+    try:
+        await conn.fetchval("select 1")
+    finally:
+        await conn.close()
+
+
+async def open_pool(db_config) -> Pool:
+    db_pool = db_config["pool"]
+    if db_pool["recycle"] > 0:
+        log.warning("database.pool.recycle isn't supported by asyncpg backend, use database.pool.idle_lifetime")
+    pool = await create_pool(
+        **connection_kwargs(db_config),
+        min_size=db_pool["minsize"],
+        max_size=db_pool["maxsize"],
+        max_inactive_connection_lifetime=db_pool["idle_lifetime"])
+    log.info(f"Database pool created with {pool.get_size()} connections")
+    return pool
+
+
+class AsyncpgDeviceRepository(DeviceRepository):
+    def __init__(self, pool: Pool):
+        self.__pool = pool
+        log.info("Device repository created")
+
+    @asynccontextmanager
+    async def __connection(self) -> Connection:
+        with span("pool.acquire"):
+            conn = await self.__pool.acquire()
+        try:
+            yield conn
+        finally:
+            await self.__pool.release(conn)
+
+    async def replace_pool(self, pool: Pool):
+        old_pool, self.__pool = self.__pool, pool
+        await old_pool.close()
+
+    async def close(self):
+        await self.__pool.close()
+
+    async def ping(self):
+        async with self.__connection() as conn:
+            await conn.fetchval("select 1")
+
+    @traced("repository.next_cert_sn")
+    async def next_cert_sn(self) -> int:
+        async with self.__connection() as conn:
+            return await conn.fetchval(NEXT_CERT_SN)
+
+    @traced("repository.count")
+    async def count(self, user_id: int) -> int:
+        async with self.__connection() as conn:
+            return await conn.fetchval(COUNT, user_id) or 0
+
+    @traced("repository.list")
+    async def list(self, user_id: int) -> List[Device]:
+        async with self.__connection() as conn:
+            return [Device(*record) for record in await conn.fetch(LIST, user_id)]
+
+    @traced("repository.list_page")
+    async def list_page(self, user_id: int, cursor: Optional[UUID], forward: bool, limit: int) -> List[Device]:
+        async with self.__connection() as conn:
+            if cursor is None:
+                records = await conn.fetch(LIST_FIRST_PAGE if forward else LIST_LAST_PAGE, user_id, limit)
+            else:
+                records = await conn.fetch(LIST_NEXT_PAGE if forward else LIST_PREV_PAGE, user_id, cursor, limit)
+            return [Device(*record) for record in (records if forward else reversed(records))]
+
+    @traced("repository.create")
+    async def create(
+            self,
+            user_id: int,
+            name: str,
+            pkey: bytes,
+            cert_req: bytes,
+            cert: bytes,
+            cert_sn: int
+    ) -> Device:
+        async with self.__connection() as conn:
+            try:
+                return Device(*await conn.fetchrow(CREATE, user_id, name, pkey, cert_req, cert, cert_sn))
+            except UniqueViolationError as e:
+                raise DuplicateKeyError from e
+
+    @traced("repository.get")
+    async def get(self, user_id: int, device_id: UUID) -> Optional[Device]:
+        async with self.__connection() as conn:
+            record = await conn.fetchrow(GET, user_id, device_id)
+            return None if record is None else Device(*record)
+
+    @traced("repository.remove")
+    async def remove(self, user_id: int, device_id: UUID) -> Optional[Device]:
+        async with self.__connection() as conn:
+            record = await conn.fetchrow(REMOVE, user_id, device_id)
+            return None if record is None else Device(*record)
+
+    @traced("repository.archive_removed")
+    async def archive_removed(self, removed_before: datetime, issued_before: datetime, limit: int) -> Tuple[int, int]:
+        async with self.__connection() as conn:
+            return tuple(await conn.fetchrow(ARCHIVE_REMOVED, removed_before, issued_before, limit))
+
+    async def ensure_audit_partition(self, month: datetime):
+        async with self.__connection() as conn:
+            await conn.execute(audit_partition_ddl(month))
+
+    @traced("repository.insert_audit_events")
+    async def insert_audit_events(self, events: List[AuditEvent]):
+        async with self.__connection() as conn:
+            await conn.copy_records_to_table(
+                "audit_events",
+                columns=("created_at", "user_id", "action", "device_id", "details"),
+                records=[
+                    (event.created_at, event.user_id, event.action, event.device_id,
+                     None if event.details is None else json.dumps(event.details))
+                    for event in events])
+
+    @traced("repository.list_audit_events")
+    async def list_audit_events(
+            self,
+            since: datetime,
+            until: datetime,
+            user_id: Optional[int],
+            limit: int
+    ) -> List[AuditEvent]:
+        async with self.__connection() as conn:
+            return [
+                AuditEvent(created_at, event_user_id, action, device_id, None if details is None else json.loads(details))
+                for created_at, event_user_id, action, device_id, details
+                in await conn.fetch(LIST_AUDIT_EVENTS, since, until, user_id, limit)]
+
+    @traced("repository.stats")
+    async def stats(self, days: int, top_users: int) -> DeviceStats:
+        async with self.__connection() as conn:
+            active_devices, active_users = await conn.fetchrow(STATS_TOTAL) or (0, 0)
+            daily = [tuple(record) for record in await conn.fetch(STATS_DAILY, days)]
+            top = [tuple(record) for record in await conn.fetch(STATS_TOP_USERS, top_users)]
+            return DeviceStats(active_devices, active_users, daily, top)
@@ -0,0 +1,100 @@
+from asyncio import Queue, QueueFull, wait_for, ensure_future, gather
+from asyncio import TimeoutError as AsyncTimeoutError
+from datetime import datetime, timezone
+from logging import getLogger
+from time import monotonic
+from typing import List, Optional, Set, Tuple
+from uuid import UUID
+
+from ovpn_bot.dao import DeviceRepository, AuditEvent
+
+log = getLogger(__name__)
+
+STOP = object()
+
+
+class AuditLog:
+    def __init__(self, device_repository: DeviceRepository, queue_size: int, batch_size: int, flush_interval: float):
+        self.__device_repository = device_repository
+        self.__queue: Queue = Queue(maxsize=queue_size)
+        self.__batch_size = batch_size
+        self.__flush_interval = flush_interval
+        self.__partitions: Set[Tuple[int, int]] = set()
+        self.__dropped = 0
+        self.__task = None
+        log.info("Audit log created")
+
+    @property
+    def queue_depth(self) -> int:
+        return self.__queue.qsize()
+
+    @property
+    def dropped(self) -> int:
+        return self.__dropped
+
+    def record(self, user_id: int, action: str, device_id: Optional[UUID] = None, **details):
+        event = AuditEvent(datetime.now(timezone.utc), user_id, action, device_id, details or None)
+        try:
+            self.__queue.put_nowait(event)
+        except QueueFull:
+            self.__dropped += 1
+            if self.__dropped % 1000 == 1:
+                log.warning(f"Audit queue is full, {self.__dropped} events dropped so far")
+
+    def start(self):
+        self.__task = ensure_future(self.__run())
+
+    async def stop(self):
+        if self.__task is not None:
+            # Flusher isn't cancelled, so batch being inserted is never written twice.
+            # It exits after flushing everything queued before the sentinel.
+            if not self.__task.done():
+                await self.__queue.put(STOP)
+            await gather(self.__task, return_exceptions=True)
+            self.__task = None
+
+        # Drain events recorded while flusher was stopping
+        events = []
+        while not self.__queue.empty():
+            event = self.__queue.get_nowait()
+            if event is not STOP:
+                events.append(event)
+        for i in range(0, len(events), self.__batch_size):
+            await self.__flush(events[i:i + self.__batch_size])
+        log.info(f"Audit log stopped, {self.__dropped} events dropped in total")
+
+    async def __run(self):
+        stopping = False
+        while not stopping:
+            # Flush either when batch is full or when the oldest event waited for flush interval
+            event = await self.__queue.get()
+            if event is STOP:
+                break
+            batch = [event]
+            deadline = monotonic() + self.__flush_interval
+            while len(batch) < self.__batch_size:
+                timeout = deadline - monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    event = await wait_for(self.__queue.get(), timeout)
+                except AsyncTimeoutError:
+                    break
+                if event is STOP:
+                    stopping = True
+                    break
+                batch.append(event)
+            await self.__flush(batch)
+
+    async def __flush(self, events: List[AuditEvent]):
+        try:
+            for month in {(event.created_at.year, event.created_at.month) for event in events} - self.__partitions:
+                await self.__device_repository.ensure_audit_partition(datetime(*month, 1, tzinfo=timezone.utc))
+                self.__partitions.add(month)
+            await self.__device_repository.insert_audit_events(events)
+        except Exception:
+            self.__dropped += len(events)
+            log.exception(f"Failed to write {len(events)} audit events")
+
+    async def list_events(self, since: datetime, until: datetime, user_id: Optional[int], limit: int) -> List[AuditEvent]:
+        return await self.__device_repository.list_audit_events(since, until, user_id, limit)
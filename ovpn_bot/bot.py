@@ -1,3 +1,5 @@
+from asyncio import Future, ensure_future
+from datetime import datetime, timedelta, timezone
 from logging import getLogger
 from typing import Union, Dict, Any, Optional
 
@@ -7,16 +9,55 @@ from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters import Filter, ChatTypeFilter
 from aiogram.dispatcher.filters.filters import AndFilter
 from aiogram.dispatcher.storage import BaseStorage
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Update, Chat, Message, ChatType
+from aiogram.types import (
+    InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Update, Chat, ChatMember, Message, ChatType)
 from aiogram.utils.callback_data import CallbackData
 
-from ovpn_bot.service import VPNService, DeviceDuplicatedError
+from ovpn_bot.logs import update_context
+from ovpn_bot.profiling import Profiler, ProfilerError
+from ovpn_bot.service import VPNService, DeviceDuplicatedError, reload_vpn_service, compact_uuid, expand_uuid
+from ovpn_bot.tracing import trace, span, traced
 
 log = getLogger(__name__)
 
+DEVICES_PAGE_SIZE = 10
+
+
+def format_size(size: int) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+def format_connection_status(vpn_service: VPNService, device) -> str:
+    if not vpn_service.is_connection_status_available():
+        return "Connection status is unavailable."
+    status = vpn_service.get_connection_status(device)
+    if status is None:
+        return "Not connected."
+    return (
+        f"Connected since {status.connected_since:%Y-%m-%d %H:%M} UTC from {status.real_address}.\n"
+        f"Received {format_size(status.bytes_received)}, sent {format_size(status.bytes_sent)}.")
+
+
+class TracingBot(Bot):
+    async def request(self, method, data=None, files=None, **kwargs):
+        with span(f"telegram.{method}"):
+            return await super(TracingBot, self).request(method, data, files, **kwargs)
+
+
+class TracingDispatcher(Dispatcher):
+    async def process_update(self, update: Update):
+        source = update.message or update.edited_message or update.callback_query
+        user_id = source.from_user.id if source is not None and source.from_user is not None else None
+        with update_context(update.update_id, user_id), trace("update", update_id=update.update_id):
+            return await super(TracingDispatcher, self).process_update(update)
+
 
 async def create_bot(config) -> Bot:
-    bot = Bot(token=config["bot_token"])
+    bot = TracingBot(token=config["bot_token"])
 
     bot_user = await bot.get_me()
     log.info(f"Bot created http://t.me/{bot_user['username']}")
@@ -27,7 +68,15 @@ async def create_storage(config) -> BaseStorage:
     return MemoryStorage()
 
 
-class GroupMemberFilter(Filter):
+async def get_users_group(bot: Bot, config) -> Chat:
+    users_group = await bot.get_chat(config["users_group_id"])
+    log.info(f"Users group loaded: {users_group.title}")
+    return users_group
+
+
+class GroupFilter(Filter):
+    access = "access"
+
     def __init__(self, users_group: Chat):
         self.__users_group = users_group
 
@@ -35,30 +84,51 @@ class GroupMemberFilter(Filter):
     def validate(cls, full_config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         raise ValueError("That filter can't be used in filters factory!")
 
+    def is_allowed(self, member: ChatMember) -> bool:
+        raise NotImplementedError
+
     async def check(self, obj: Union[Message, CallbackQuery]) -> bool:
         member = await self.__users_group.get_member(obj.from_user.id)
-        is_chat_member = member.is_chat_member()
-        if not is_chat_member:
-            log.info(f"Unauthorized access from {obj.from_user.id} ({obj.from_user.username})")
+        if not self.is_allowed(member):
+            log.info(f"Unauthorized {self.access} from {obj.from_user.id} ({obj.from_user.username})")
             return False
-        return is_chat_member
+        return True
+
+
+class GroupMemberFilter(GroupFilter):
+    def is_allowed(self, member: ChatMember) -> bool:
+        return member.is_chat_member()
+
+
+class GroupAdminFilter(GroupFilter):
+    access = "admin access"
+
+    def is_allowed(self, member: ChatMember) -> bool:
+        return member.is_chat_admin()
 
 
 async def create_bot_dispatcher(
         bot: Bot,
         storage: BaseStorage,
         vpn_service: VPNService,
+        users_group: Chat,
+        profiler: Profiler,
         config
 ) -> Dispatcher:
     authorized = AndFilter(
         ChatTypeFilter(ChatType.PRIVATE),
-        GroupMemberFilter(await bot.get_chat(config["users_group_id"])))
+        GroupMemberFilter(users_group))
+    admin = AndFilter(
+        ChatTypeFilter(ChatType.PRIVATE),
+        GroupAdminFilter(users_group))
 
-    dispatcher = Dispatcher(bot=bot, storage=storage)
+    dispatcher = TracingDispatcher(bot=bot, storage=storage)
 
     devices_cb = CallbackData("device", "id", "action")
+    pages_cb = CallbackData("page", "cursor", "direction")
 
     @dispatcher.errors_handler()
+    @traced("handler.error")
     async def error_handler(update: Update, exc: BaseException):
         if update.message is not None:
             chat_id = update.message.from_user.id
@@ -83,23 +153,45 @@ async def create_bot_dispatcher(
 
     @dispatcher.message_handler(authorized, commands=["start", "restart"])
     @dispatcher.callback_query_handler(authorized, lambda query: query.data == 'list', state="*")
+    @dispatcher.callback_query_handler(authorized, pages_cb.filter(), state="*")
+    @traced("handler.list")
     async def list_handler(event: Union[Message, CallbackQuery], state: FSMContext):
         await state.finish()
 
         if isinstance(event, Message):
             await event.delete()
 
-        devices = await vpn_service.list_devices(event.from_user.id)
+        if isinstance(event, CallbackQuery) and event.data != "list":
+            cb_data = pages_cb.parse(event.data)
+            page = await vpn_service.list_devices_page(
+                event.from_user.id,
+                expand_uuid(cb_data["cursor"]),
+                cb_data["direction"] == "next",
+                DEVICES_PAGE_SIZE)
+        else:
+            page = await vpn_service.list_devices_page(event.from_user.id, limit=DEVICES_PAGE_SIZE)
+
         keyboard_markup = InlineKeyboardMarkup(row_width=2)
         keyboard_markup.add(
             InlineKeyboardButton("➕ Add new device", callback_data="add"),
             InlineKeyboardButton("🔄 Refresh", callback_data="list"))
         keyboard_markup.add(*(
-            InlineKeyboardButton(device.name, callback_data=devices_cb.new(id=device.id, action="details"))
-            for device in devices))
+            InlineKeyboardButton(device.name, callback_data=devices_cb.new(id=compact_uuid(device.id), action="details"))
+            for device in page.devices))
+        navigation = []
+        if page.devices and page.has_prev:
+            navigation.append(InlineKeyboardButton(
+                "◀️ Prev",
+                callback_data=pages_cb.new(cursor=compact_uuid(page.devices[0].id), direction="prev")))
+        if page.devices and page.has_next:
+            navigation.append(InlineKeyboardButton(
+                "Next ▶️",
+                callback_data=pages_cb.new(cursor=compact_uuid(page.devices[-1].id), direction="next")))
+        if navigation:
+            keyboard_markup.row(*navigation)
         await bot.send_message(
             event.from_user.id,
-            "Choose one of your devices." if devices else "You have no devices.",
+            "Choose one of your devices." if page.devices else "You have no devices.",
             reply_markup=keyboard_markup)
 
         if isinstance(event, CallbackQuery):
@@ -107,6 +199,7 @@ async def create_bot_dispatcher(
             await event.answer()
 
     @dispatcher.callback_query_handler(authorized, lambda query: query.data == 'add')
+    @traced("handler.add")
     async def add_handler(query: CallbackQuery, state: FSMContext):
         keyboard_markup = InlineKeyboardMarkup(row_width=2)
         keyboard_markup.add(InlineKeyboardButton("<< Back", callback_data="list"))
@@ -129,6 +222,7 @@ async def create_bot_dispatcher(
         await query.answer()
 
     @dispatcher.message_handler(authorized, lambda message: message.text, state="device_name")
+    @traced("handler.device_name")
     async def device_name_handler(message: Message, state: FSMContext):
         keyboard_markup = InlineKeyboardMarkup(row_width=2)
         keyboard_markup.add(InlineKeyboardButton("<< Back", callback_data="list"))
@@ -152,11 +246,12 @@ async def create_bot_dispatcher(
 
     @dispatcher.callback_query_handler(authorized, devices_cb.filter(action="details"))
     @dispatcher.callback_query_handler(authorized, devices_cb.filter(action="config"))
+    @traced("handler.details")
     async def details_handler(query: CallbackQuery):
         cb_data = devices_cb.parse(query.data)
         action = cb_data["action"]
         device_id = cb_data["id"]
-        device = await vpn_service.get_device(query.from_user.id, device_id)
+        device = await vpn_service.get_device(query.from_user.id, expand_uuid(device_id))
 
         keyboard_markup = InlineKeyboardMarkup(row_width=2)
         keyboard_markup.add(
@@ -165,7 +260,7 @@ async def create_bot_dispatcher(
             InlineKeyboardButton("<< Back", callback_data="list"))
 
         if action == "config":
-            with await vpn_service.generate_device_config(query.from_user.id, device_id) as config_stream:
+            with await vpn_service.generate_device_config(query.from_user.id, device.id) as config_stream:
                 await bot.send_document(
                     query.from_user.id,
                     config_stream,
@@ -175,7 +270,7 @@ async def create_bot_dispatcher(
         else:
             await bot.send_message(
                 query.from_user.id,
-                f"What to do with device *{device.name}*?",
+                f"What to do with device *{device.name}*?\n\n{format_connection_status(vpn_service, device)}",
                 parse_mode="markdown",
                 reply_markup=keyboard_markup)
 
@@ -183,9 +278,10 @@ async def create_bot_dispatcher(
         await query.answer()
 
     @dispatcher.callback_query_handler(authorized, devices_cb.filter(action="remove"))
+    @traced("handler.remove")
     async def remove_handler(query: CallbackQuery):
         device_id = devices_cb.parse(query.data)["id"]
-        device = await vpn_service.get_device(query.from_user.id, device_id)
+        device = await vpn_service.get_device(query.from_user.id, expand_uuid(device_id))
 
         keyboard_markup = InlineKeyboardMarkup(row_width=2)
         keyboard_markup.add(
@@ -201,9 +297,10 @@ async def create_bot_dispatcher(
         await query.answer()
 
     @dispatcher.callback_query_handler(authorized, devices_cb.filter(action="confirm_removal"))
+    @traced("handler.confirm_removal")
     async def confirm_removal_handler(query: CallbackQuery):
         device_id = devices_cb.parse(query.data)["id"]
-        device = await vpn_service.remove_device(query.from_user.id, device_id)
+        device = await vpn_service.remove_device(query.from_user.id, expand_uuid(device_id))
 
         keyboard_markup = InlineKeyboardMarkup(row_width=2)
         keyboard_markup.add(InlineKeyboardButton("<< Back", callback_data="list"))
@@ -217,8 +314,81 @@ async def create_bot_dispatcher(
         await query.answer()
 
     @dispatcher.message_handler(authorized, commands=["user_id"])
+    @traced("handler.chat_id")
     async def chat_id_handler(message: Message):
         await message.answer(f"User ID: {message.from_user.id}")
 
+    @dispatcher.message_handler(admin, commands=["reload"])
+    @traced("handler.reload")
+    async def reload_handler(message: Message):
+        await reload_vpn_service(vpn_service)
+        await message.answer("Configuration reloaded.")
+
+    @dispatcher.message_handler(admin, commands=["stats"])
+    @traced("handler.stats")
+    async def stats_handler(message: Message):
+        stats = await vpn_service.get_stats()
+        lines = [
+            f"Active devices: *{stats.active_devices}*",
+            f"Users with devices: *{stats.active_users}*",
+            "",
+            "Daily (created / removed):",
+            *(f"{day:%Y-%m-%d}: {created} / {removed}" for day, created, removed in stats.daily),
+            "",
+            "Top users:",
+            *(f"`{user_id}`: {active}" for user_id, active in stats.top_users)]
+        await message.answer("\n".join(lines), parse_mode="markdown")
+
+    @dispatcher.message_handler(admin, commands=["audit"])
+    @traced("handler.audit")
+    async def audit_handler(message: Message):
+        args = message.get_args().split()
+        try:
+            hours = float(args[0]) if args else 24.0
+            user_id = int(args[1]) if len(args) > 1 else None
+        except ValueError:
+            await message.answer("Usage: /audit [hours] [user_id]")
+            return
+
+        until = datetime.now(timezone.utc)
+        events = await vpn_service.list_audit_events(until - timedelta(hours=hours), until, user_id)
+        queue_depth, dropped = vpn_service.get_audit_queue_stats()
+
+        lines = [
+            f"{event.created_at:%Y-%m-%d %H:%M:%S} {event.user_id} {event.action} "
+            f"{(event.details or {}).get('name', event.device_id or '')}"
+            for event in events]
+        lines.append(f"Queue depth: {queue_depth}, dropped events: {dropped}")
+        await message.answer("\n".join(lines))
+
+    async def report_profile(message: Message, profile: Future):
+        try:
+            result = await profile
+        except Exception:
+            log.exception("Profiling failed")
+            await message.answer("Profiling failed, see logs for details.")
+            return
+
+        lines = [
+            f"Profiling with {result.mode} finished after {result.duration:g}s",
+            f"Loop lag: max {result.max_loop_lag * 1000:.1f} ms, mean {result.mean_loop_lag * 1000:.1f} ms",
+            f"Slow callbacks: {result.slow_callbacks}",
+            *result.files]
+        await message.answer("\n".join(lines))
+
+    @dispatcher.message_handler(admin, commands=["profile"])
+    @traced("handler.profile")
+    async def profile_handler(message: Message):
+        args = message.get_args().split()
+        try:
+            duration = float(args[0]) if args else 10.0
+            profile = profiler.start(duration, args[1] if len(args) > 1 else "sampling")
+        except (ProfilerError, ValueError) as e:
+            await message.answer(f"{e}\nUsage: /profile [seconds] [sampling|cprofile]")
+            return
+
+        await message.answer(f"Profiling started for {duration:g}s.")
+        ensure_future(report_profile(message, profile))
+
     log.info("Bot dispatcher created")
     return dispatcher
@@ -1,15 +1,20 @@
+from base64 import b64decode, b64encode
 from datetime import datetime
 from logging import getLogger
 from typing import Iterable
 
 from OpenSSL.crypto import (
-    load_certificate, load_privatekey, FILETYPE_PEM, X509, PKey, TYPE_RSA, X509Req,
+    load_certificate, load_privatekey, FILETYPE_PEM, FILETYPE_ASN1, X509, PKey, TYPE_RSA, X509Req,
     dump_privatekey, dump_certificate_request, dump_certificate, load_certificate_request, CRL,
     Revoked
 )
 
+from ovpn_bot.tracing import traced
+
 log = getLogger(__name__)
 
+CERT_LIFETIME = 365 * 24 * 60 * 60
+
 
 def create_cert_manager(config):
     pki_config = config["pki"]
@@ -30,28 +35,40 @@ def write_file(filename: str, buffer: bytes):
         file.write(buffer)
 
 
-def dump_key(pkey: PKey) -> str:
-    return dump_privatekey(FILETYPE_PEM, pkey).decode("utf-8")
+def pem_to_der(buffer: bytes) -> bytes:
+    lines = buffer.strip().splitlines()
+    return b64decode(b"".join(lines[1:-1]))
+
+
+def der_to_pem(buffer: bytes, label: str) -> str:
+    body = b64encode(buffer).decode("ascii")
+    lines = [body[i:i + 64] for i in range(0, len(body), 64)]
+    return "\n".join([f"-----BEGIN {label}-----", *lines, f"-----END {label}-----", ""])
+
+
+def dump_key(pkey: PKey) -> bytes:
+    # PKCS#8 DER, the same bytes as the body of PEM "PRIVATE KEY" block
+    return pem_to_der(dump_privatekey(FILETYPE_PEM, pkey))
 
 
-def load_key(buffer: str) -> PKey:
-    return load_privatekey(FILETYPE_PEM, buffer.encode("utf-8"))
+def load_key(buffer: bytes) -> PKey:
+    return load_privatekey(FILETYPE_ASN1, buffer)
 
 
-def dump_cert_req(cert_req: X509Req) -> str:
-    return dump_certificate_request(FILETYPE_PEM, cert_req).decode("utf-8")
+def dump_cert_req(cert_req: X509Req) -> bytes:
+    return dump_certificate_request(FILETYPE_ASN1, cert_req)
 
 
-def load_cert_req(buffer: str) -> X509Req:
-    return load_certificate_request(FILETYPE_PEM, buffer.encode("utf-8"))
+def load_cert_req(buffer: bytes) -> X509Req:
+    return load_certificate_request(FILETYPE_ASN1, buffer)
 
 
-def dump_cert(cert: X509) -> str:
-    return dump_certificate(FILETYPE_PEM, cert).decode("utf-8")
+def dump_cert(cert: X509) -> bytes:
+    return dump_certificate(FILETYPE_ASN1, cert)
 
 
-def load_cert(buffer: str) -> X509:
-    return load_certificate(FILETYPE_PEM, buffer.encode("utf-8"))
+def load_cert(buffer: bytes) -> X509:
+    return load_certificate(FILETYPE_ASN1, buffer)
 
 
 class CertManager:
@@ -60,21 +77,27 @@ class CertManager:
         self.__cert = cert
         self.__pkey = pkey
         self.__tls_auth = tls_auth
+        # PEM forms are embedded into every generated config, so they are rendered once
+        self.__ca_pem = dump_certificate(FILETYPE_PEM, ca).decode("utf-8")
+        self.__cert_pem = dump_certificate(FILETYPE_PEM, cert).decode("utf-8")
+        self.__tls_auth_pem = tls_auth.decode("utf-8")
 
-    def dump_ca(self):
-        return dump_cert(self.__ca)
+    def dump_ca(self) -> str:
+        return self.__ca_pem
 
-    def dump_root_cert(self):
-        return dump_cert(self.__cert)
+    def dump_root_cert(self) -> str:
+        return self.__cert_pem
 
-    def dump_tls_auth(self):
-        return self.__tls_auth.decode("utf-8")
+    def dump_tls_auth(self) -> str:
+        return self.__tls_auth_pem
 
+    @traced("cert_manager.create_private_key")
     def create_private_key(self) -> PKey:
         pkey = PKey()
         pkey.generate_key(TYPE_RSA, self.__pkey.bits())
         return pkey
 
+    @traced("cert_manager.create_certificate_request")
     def create_certificate_request(self, common_name, pkey) -> X509Req:
         cert_req = X509Req()
         cert_req.set_pubkey(pkey)
@@ -89,6 +112,7 @@ class CertManager:
         cert_req.sign(self.__pkey, "sha256")
         return cert_req
 
+    @traced("cert_manager.sign_certificate_request")
     def sign_certificate_request(self, cert_req: X509Req, serial_number: int) -> X509:
         cert = X509()
         cert.set_issuer(self.__cert.get_subject())
@@ -96,10 +120,11 @@ class CertManager:
         cert.set_subject(cert_req.get_subject())
         cert.set_serial_number(serial_number)
         cert.gmtime_adj_notBefore(0)
-        cert.gmtime_adj_notAfter(365 * 24 * 60 * 60)
+        cert.gmtime_adj_notAfter(CERT_LIFETIME)
         cert.sign(self.__pkey, "sha256")
         return cert
 
+    @traced("cert_manager.create_crl")
     def create_crl(self, serial_numbers: Iterable[int]) -> bytes:
         timestamp = (datetime.utcnow().strftime("%Y%m%d%H%M%S") + "Z").encode("utf-8")
         crl = CRL()
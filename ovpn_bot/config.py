@@ -4,7 +4,7 @@ from logging import getLogger
 from os import environ
 from typing import Dict
 
-from confuse import Configuration, String, Integer, Number, Filename
+from confuse import Configuration, String, Integer, Number, Filename, Sequence, TypeTemplate, Choice
 
 log = getLogger(__name__)
 
@@ -39,6 +39,10 @@ def parse_args() -> Namespace:
         "--users-group-id",
         default=environ.get("USERS_GROUP_ID"))
 
+    parser.add_argument(
+        "--database.backend",
+        default=environ.get("DATABASE_BACKEND"))
+
     parser.add_argument(
         "--database.host",
         default=environ.get("DATABASE_HOST"))
@@ -85,6 +89,11 @@ def parse_args() -> Namespace:
         type=int,
         default=environ.get("DATABASE_POOL_RECYCLE"))
 
+    parser.add_argument(
+        "--database.pool.idle-lifetime",
+        type=float,
+        default=environ.get("DATABASE_POOL_IDLE_LIFETIME"))
+
     parser.add_argument(
         "--pki.ca",
         default=environ.get("PKI_CA"))
@@ -119,17 +128,172 @@ def parse_args() -> Namespace:
         type=int,
         default=environ.get("DEFAULT_MAX_DEVICES"))
 
+    parser.add_argument(
+        "--archive.retention",
+        type=int,
+        default=environ.get("ARCHIVE_RETENTION"))
+
+    parser.add_argument(
+        "--archive.interval",
+        type=float,
+        default=environ.get("ARCHIVE_INTERVAL"))
+
+    parser.add_argument(
+        "--archive.batch-size",
+        type=int,
+        default=environ.get("ARCHIVE_BATCH_SIZE"))
+
+    parser.add_argument(
+        "--archive.pause",
+        type=float,
+        default=environ.get("ARCHIVE_PAUSE"))
+
+    parser.add_argument(
+        "--audit.queue-size",
+        type=int,
+        default=environ.get("AUDIT_QUEUE_SIZE"))
+
+    parser.add_argument(
+        "--audit.batch-size",
+        type=int,
+        default=environ.get("AUDIT_BATCH_SIZE"))
+
+    parser.add_argument(
+        "--audit.flush-interval",
+        type=float,
+        default=environ.get("AUDIT_FLUSH_INTERVAL"))
+
+    parser.add_argument(
+        "--balancing.remote-random",
+        type=lambda value: value.lower() in ("1", "true", "yes"),
+        default=environ.get("BALANCING_REMOTE_RANDOM"))
+
+    parser.add_argument(
+        "--management.host",
+        default=environ.get("MANAGEMENT_HOST"))
+
+    parser.add_argument(
+        "--management.port",
+        type=int,
+        default=environ.get("MANAGEMENT_PORT"))
+
+    parser.add_argument(
+        "--management.socket",
+        default=environ.get("MANAGEMENT_SOCKET"))
+
+    parser.add_argument(
+        "--management.interval",
+        type=float,
+        default=environ.get("MANAGEMENT_INTERVAL"))
+
+    parser.add_argument(
+        "--management.timeout",
+        type=float,
+        default=environ.get("MANAGEMENT_TIMEOUT"))
+
+    parser.add_argument(
+        "--tracing.exporter",
+        default=environ.get("TRACING_EXPORTER"))
+
+    parser.add_argument(
+        "--tracing.path",
+        default=environ.get("TRACING_PATH"))
+
+    parser.add_argument(
+        "--tracing.endpoint",
+        default=environ.get("TRACING_ENDPOINT"))
+
+    parser.add_argument(
+        "--tracing.sample-rate",
+        type=float,
+        default=environ.get("TRACING_SAMPLE_RATE"))
+
+    parser.add_argument(
+        "--tracing.queue-size",
+        type=int,
+        default=environ.get("TRACING_QUEUE_SIZE"))
+
+    parser.add_argument(
+        "--health.host",
+        default=environ.get("HEALTH_HOST"))
+
+    parser.add_argument(
+        "--health.port",
+        type=int,
+        default=environ.get("HEALTH_PORT"))
+
+    parser.add_argument(
+        "--health.timeout",
+        type=float,
+        default=environ.get("HEALTH_TIMEOUT"))
+
+    parser.add_argument(
+        "--profiling.directory",
+        default=environ.get("PROFILING_DIRECTORY"))
+
+    parser.add_argument(
+        "--profiling.slow-callback",
+        type=float,
+        default=environ.get("PROFILING_SLOW_CALLBACK"))
+
+    parser.add_argument(
+        "--logging.level",
+        default=environ.get("LOGGING_LEVEL"))
+
+    parser.add_argument(
+        "--logging.format",
+        default=environ.get("LOGGING_FORMAT"))
+
+    parser.add_argument(
+        "--logging.rate-limit.interval",
+        type=float,
+        default=environ.get("LOGGING_RATE_LIMIT_INTERVAL"))
+
+    parser.add_argument(
+        "--logging.rate-limit.burst",
+        type=int,
+        default=environ.get("LOGGING_RATE_LIMIT_BURST"))
+
     parsed_args = parser.parse_args()
 
     log.info("Arguments parsed")
     return parsed_args
 
 
+def warn_shadowed_file_values(config: Configuration, args: Namespace):
+    # Environment of running process never changes, so values shadowed by it can't be reloaded
+    for key, value in vars(args).items():
+        if value is None:
+            continue
+        for source in config.sources:
+            if source.filename is None or source.default:
+                continue
+            file_value = source
+            for label in key.split("."):
+                if not isinstance(file_value, dict) or label not in file_value:
+                    break
+                file_value = file_value[label]
+            else:
+                if file_value != value:
+                    log.warning(f"Value of {key} from {source.filename} is overridden by environment or argument")
+
+
+MANAGEMENT_TEMPLATE = {
+    "host": String(default=None),
+    "port": Integer(default=7505),
+    "socket": String(default=None),
+    "password": String(default=None),
+    "interval": Number(default=10.0),
+    "timeout": Number(default=5.0)
+}
+
+
 def load_config() -> Configuration:
     template = {
         "bot_token": String(),
         "users_group_id": String(),
         "database": {
+            "backend": Choice(["aiopg", "asyncpg"], default="aiopg"),
             "host": String(default="localhost"),
             "port": Integer(default=5432),
             "name": String(default="postgres"),
@@ -140,7 +304,10 @@ def load_config() -> Configuration:
             "pool": {
                 "minsize": Integer(default=2),
                 "maxsize": Integer(default=10),
-                "recycle": Integer(default=-1)
+                # Max age of connection, aiopg only
+                "recycle": Integer(default=-1),
+                # Max idle time of connection, asyncpg only
+                "idle_lifetime": Number(default=300.0)
             }
         },
         "pki": {
@@ -156,12 +323,65 @@ def load_config() -> Configuration:
         },
         "default": {
             "max_devices": Integer(default=6)
+        },
+        "archive": {
+            "retention": Integer(default=30),
+            "interval": Number(default=3600.0),
+            "batch_size": Integer(default=500),
+            "pause": Number(default=0.1)
+        },
+        "audit": {
+            "queue_size": Integer(default=10000),
+            "batch_size": Integer(default=500),
+            "flush_interval": Number(default=2.0)
+        },
+        "servers": Sequence({
+            "host": String(),
+            "port": Integer(default=1443),
+            "weight": Number(default=1.0),
+            "region": String(default=None),
+            "management": MANAGEMENT_TEMPLATE
+        }),
+        "balancing": {
+            "remote_random": TypeTemplate(bool, default=False)
+        },
+        "management": MANAGEMENT_TEMPLATE,
+        "tracing": {
+            "exporter": Choice(["none", "jsonl", "otlp"], default="none"),
+            "path": Filename(default="traces.jsonl"),
+            "endpoint": String(default="http://localhost:4318/v1/traces"),
+            "timeout": Number(default=5.0),
+            "sample_rate": Number(default=1.0),
+            "queue_size": Integer(default=10000)
+        },
+        "health": {
+            "host": String(default="127.0.0.1"),
+            "port": Integer(default=8080),
+            "timeout": Number(default=3.0)
+        },
+        "profiling": {
+            "directory": Filename(default="profiles"),
+            "sampling_interval": Number(default=0.005),
+            "slow_callback": Number(default=0.1),
+            "max_duration": Number(default=300.0)
+        },
+        "logging": {
+            "level": Choice(["DEBUG", "INFO", "WARNING", "ERROR"], default="INFO"),
+            "format": Choice(["text", "json"], default="text"),
+            "rate_limit": {
+                "interval": Number(default=60.0),
+                "burst": Integer(default=20)
+            }
         }
     }
 
     config = Configuration("VpnBot", __name__)
+    # Servers list can be given in config file only, single server falls back to "server" block
+    config.add({"servers": []})
     config.set(load_secrets())
-    config.set_args(parse_args(), dots=True)
+    args = parse_args()
+    config.set_args(args, dots=True)
+    warn_shadowed_file_values(config, args)
 
     log.info("Configuration loaded")
     return config.get(template)
@@ -1,69 +1,355 @@
-from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta, date
 from logging import getLogger
-from typing import List, Optional
+from typing import List, Optional, Tuple, NamedTuple, Dict, Any, Protocol
 from uuid import UUID
 
 from aiopg import Pool
+from psycopg2.errors import UniqueViolation
+from psycopg2.extras import Json
+
+from ovpn_bot.certs import der_to_pem
+from ovpn_bot.tracing import span, traced
 
 log = getLogger(__name__)
 
+DEVICE_COLUMNS = "id, user_id, name, pkey, cert_req, cert, cert_sn, created_at, removed"
+
+
+class DuplicateKeyError(Exception):
+    pass
+
+
+def audit_partition_ddl(month: datetime) -> str:
+    month_start = month.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    next_month_start = (month_start + timedelta(days=32)).replace(day=1)
+    # Instances creating the same partition at once would fail on "if not exists" race,
+    # so creation is serialized by advisory lock held till the end of the statement.
+    # DDL can't take bind parameters, bounds are built from datetimes only.
+    return f"""
+        do $$
+        begin
+            perform pg_advisory_xact_lock('audit_events'::regclass::oid::bigint);
+            create table if not exists audit_events_{month_start:%Y_%m} partition of audit_events
+            for values from ('{month_start.isoformat()}') to ('{next_month_start.isoformat()}');
+        end;
+        $$
+    """
+
 
-@dataclass
 class Device:
-    id: UUID
-    user_id: int
-    name: str
-    pkey: str
-    cert_req: str
-    cert: str
-    cert_sn: int
+    __slots__ = ("id", "user_id", "name", "pkey", "cert_req", "cert", "cert_sn", "created_at", "removed")
+
+    def __init__(
+            self,
+            id: UUID,
+            user_id: int,
+            name: str,
+            pkey: bytes,
+            cert_req: bytes,
+            cert: bytes,
+            cert_sn: int,
+            created_at: datetime,
+            removed: bool
+    ):
+        self.id = id
+        self.user_id = user_id
+        self.name = name
+        self.pkey = pkey
+        self.cert_req = cert_req
+        self.cert = cert
+        self.cert_sn = cert_sn
+        self.created_at = created_at
+        self.removed = removed
+
+    def __repr__(self) -> str:
+        return f"Device(id={self.id!r}, user_id={self.user_id!r}, name={self.name!r}, cert_sn={self.cert_sn!r})"
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Device):
+            return NotImplemented
+        return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+    @property
+    def pkey_pem(self) -> str:
+        return der_to_pem(self.pkey, "PRIVATE KEY")
+
+    @property
+    def cert_req_pem(self) -> str:
+        return der_to_pem(self.cert_req, "CERTIFICATE REQUEST")
+
+    @property
+    def cert_pem(self) -> str:
+        return der_to_pem(self.cert, "CERTIFICATE")
+
+
+class AuditEvent(NamedTuple):
     created_at: datetime
-    removed: bool
+    user_id: int
+    action: str
+    device_id: Optional[UUID]
+    details: Optional[Dict[str, Any]]
+
+
+class DeviceStats(NamedTuple):
+    active_devices: int
+    active_users: int
+    daily: List[Tuple[date, int, int]]
+    top_users: List[Tuple[int, int]]
+
+
+# Common interface of aiopg and asyncpg backends, see create_device_repository
+class DeviceRepository(Protocol):
+    async def replace_pool(self, pool: Any):
+        ...
+
+    async def close(self):
+        ...
+
+    async def ping(self):
+        ...
+
+    async def next_cert_sn(self) -> int:
+        ...
+
+    async def count(self, user_id: int) -> int:
+        ...
+
+    async def list(self, user_id: int) -> List[Device]:
+        ...
+
+    async def list_page(self, user_id: int, cursor: Optional[UUID], forward: bool, limit: int) -> List[Device]:
+        ...
+
+    async def create(
+            self,
+            user_id: int,
+            name: str,
+            pkey: bytes,
+            cert_req: bytes,
+            cert: bytes,
+            cert_sn: int
+    ) -> Device:
+        ...
+
+    async def get(self, user_id: int, device_id: UUID) -> Optional[Device]:
+        ...
+
+    async def remove(self, user_id: int, device_id: UUID) -> Optional[Device]:
+        ...
+
+    async def archive_removed(self, removed_before: datetime, issued_before: datetime, limit: int) -> Tuple[int, int]:
+        ...
+
+    async def ensure_audit_partition(self, month: datetime):
+        ...
+
+    async def insert_audit_events(self, events: List[AuditEvent]):
+        ...
+
+    async def list_audit_events(
+            self,
+            since: datetime,
+            until: datetime,
+            user_id: Optional[int],
+            limit: int
+    ) -> List[AuditEvent]:
+        ...
 
+    async def stats(self, days: int, top_users: int) -> DeviceStats:
+        ...
 
-class DeviceRepository:
+
+class AiopgDeviceRepository(DeviceRepository):
     def __init__(self, pool: Pool):
         self.__pool = pool
         log.info("Device repository created")
 
+    async def replace_pool(self, pool: Pool):
+        old_pool, self.__pool = self.__pool, pool
+        old_pool.close()
+        await old_pool.wait_closed()
+
+    async def close(self):
+        self.__pool.close()
+        await self.__pool.wait_closed()
+
+    async def __cursor(self):
+        with span("pool.acquire"):
+            return await self.__pool.cursor()
+
+    async def ping(self):
+        with await self.__cursor() as cur:
+            await cur.execute("select 1")
+
+    @traced("repository.next_cert_sn")
     async def next_cert_sn(self) -> int:
-        with await self.__pool.cursor() as cur:
+        with await self.__cursor() as cur:
             await cur.execute("select nextval('certs_sn')")
             return (await cur.fetchone())[0]
 
+    @traced("repository.count")
     async def count(self, user_id: int) -> int:
-        with await self.__pool.cursor() as cur:
-            await cur.execute("select count(*) from devices where user_id = %s and not removed", [user_id])
-            return (await cur.fetchone())[0]
+        with await self.__cursor() as cur:
+            # Counter is maintained by trigger on devices, so it's a primary key lookup
+            await cur.execute("select active_devices from user_device_stats where user_id = %s", [user_id])
+            result = await cur.fetchone()
+            return 0 if result is None else result[0]
 
+    @traced("repository.list")
     async def list(self, user_id: int) -> List[Device]:
-        with await self.__pool.cursor() as cur:
-            await cur.execute("select * from devices where user_id = %s and not removed", [user_id])
+        with await self.__cursor() as cur:
+            await cur.execute(f"select {DEVICE_COLUMNS} from devices where user_id = %s and not removed", [user_id])
             return [Device(*record) for record in await cur.fetchall()]
 
-    async def create(self, user_id: int, name: str, pkey: str, cert_req: str, cert: str, cert_sn: int) -> Device:
-        with await self.__pool.cursor() as cur:
+    @traced("repository.list_page")
+    async def list_page(self, user_id: int, cursor: Optional[UUID], forward: bool, limit: int) -> List[Device]:
+        # Keyset pagination over (created_at, id), the cursor row is looked up by id
+        # to keep callback payloads compact
+        comparison, order = (">", "asc") if forward else ("<", "desc")
+        condition = "" if cursor is None else (
+            f"and (created_at, id) {comparison} "
+            f"(select created_at, id from devices where user_id = %(user_id)s and id = %(cursor)s)")
+        with await self.__cursor() as cur:
             await cur.execute(
-                """
-                insert into devices (user_id, name, pkey, cert_req, cert, cert_sn) 
-                values (%s, %s, %s, %s, %s, %s) returning *
+                f"""
+                select {DEVICE_COLUMNS} from devices
+                where user_id = %(user_id)s and not removed {condition}
+                order by created_at {order}, id {order}
+                limit %(limit)s
                 """,
-                [user_id, name, pkey, cert_req, cert, cert_sn])
+                {"user_id": user_id, "cursor": cursor, "limit": limit})
+            records = await cur.fetchall()
+            return [Device(*record) for record in (records if forward else reversed(records))]
+
+    @traced("repository.create")
+    async def create(
+            self,
+            user_id: int,
+            name: str,
+            pkey: bytes,
+            cert_req: bytes,
+            cert: bytes,
+            cert_sn: int
+    ) -> Device:
+        with await self.__cursor() as cur:
+            try:
+                await cur.execute(
+                    f"""
+                    insert into devices (user_id, name, pkey, cert_req, cert, cert_sn) 
+                    values (%s, %s, %s, %s, %s, %s) returning {DEVICE_COLUMNS}
+                    """,
+                    [user_id, name, pkey, cert_req, cert, cert_sn])
+            except UniqueViolation as e:
+                raise DuplicateKeyError from e
             return Device(*await cur.fetchone())
 
+    @traced("repository.get")
     async def get(self, user_id: int, device_id: UUID) -> Optional[Device]:
-        with await self.__pool.cursor() as cur:
+        with await self.__cursor() as cur:
             await cur.execute(
-                "select * from devices where user_id = %s and id = %s and not removed",
+                f"select {DEVICE_COLUMNS} from devices where user_id = %s and id = %s and not removed",
                 [user_id, device_id])
             result = await cur.fetchone()
             return None if result is None else Device(*result)
 
+    @traced("repository.remove")
     async def remove(self, user_id: int, device_id: UUID) -> Optional[Device]:
-        with await self.__pool.cursor() as cur:
+        with await self.__cursor() as cur:
             await cur.execute(
-                "update devices set removed = true where user_id = %s and id = %s and not removed returning *",
+                "update devices set removed = true, removed_at = current_timestamp "
+                "where user_id = %s and id = %s and not removed "
+                f"returning {DEVICE_COLUMNS}",
                 [user_id, device_id])
             result = await cur.fetchone()
             return None if result is None else Device(*result)
+
+    @traced("repository.archive_removed")
+    async def archive_removed(self, removed_before: datetime, issued_before: datetime, limit: int) -> Tuple[int, int]:
+        with await self.__cursor() as cur:
+            await cur.execute(
+                """
+                with moved as (
+                    delete from devices
+                    where id in (
+                        select id from devices
+                        where removed
+                          and (removed_at < %(removed_before)s or removed_at is null)
+                          and created_at < %(issued_before)s
+                        limit %(limit)s
+                        for update skip locked)
+                    returning id, user_id, name, cert, cert_sn, created_at, removed_at, pg_column_size(devices.*) as size
+                ), archived as (
+                    insert into devices_archive (id, user_id, name, cert, cert_sn, created_at, removed_at)
+                    select id, user_id, name, cert, cert_sn, created_at, removed_at from moved
+                )
+                select count(*), coalesce(sum(size), 0)::bigint from moved
+                """,
+                {"removed_before": removed_before, "issued_before": issued_before, "limit": limit})
+            return await cur.fetchone()
+
+    async def ensure_audit_partition(self, month: datetime):
+        with await self.__cursor() as cur:
+            await cur.execute(audit_partition_ddl(month))
+
+    @traced("repository.insert_audit_events")
+    async def insert_audit_events(self, events: List[AuditEvent]):
+        values = ", ".join(["(%s, %s, %s, %s, %s)"] * len(events))
+        params = [
+            value
+            for event in events
+            for value in (
+                event.created_at,
+                event.user_id,
+                event.action,
+                event.device_id,
+                None if event.details is None else Json(event.details))]
+        with await self.__cursor() as cur:
+            await cur.execute(
+                f"insert into audit_events (created_at, user_id, action, device_id, details) values {values}",
+                params)
+
+    @traced("repository.list_audit_events")
+    async def list_audit_events(
+            self,
+            since: datetime,
+            until: datetime,
+            user_id: Optional[int],
+            limit: int
+    ) -> List[AuditEvent]:
+        # Bounded time range lets planner prune partitions outside of it
+        with await self.__cursor() as cur:
+            await cur.execute(
+                """
+                select created_at, user_id, action, device_id, details from audit_events
+                where created_at >= %(since)s and created_at < %(until)s
+                  and (%(user_id)s::bigint is null or user_id = %(user_id)s)
+                order by created_at desc
+                limit %(limit)s
+                """,
+                {"since": since, "until": until, "user_id": user_id, "limit": limit})
+            return [AuditEvent(*record) for record in await cur.fetchall()]
+
+    @traced("repository.stats")
+    async def stats(self, days: int, top_users: int) -> DeviceStats:
+        with await self.__cursor() as cur:
+            # Counters are sharded by user id to avoid a single hot row, so shards are summed up
+            await cur.execute(
+                "select coalesce(sum(active_devices), 0), coalesce(sum(active_users), 0) from device_stats")
+            active_devices, active_users = await cur.fetchone()
+            await cur.execute(
+                """
+                select day, sum(created_devices), sum(removed_devices) from device_stats_daily
+                group by day
+                order by day desc
+                limit %s
+                """,
+                [days])
+            daily = await cur.fetchall()
+            await cur.execute(
+                """
+                select user_id, active_devices from user_device_stats
+                order by active_devices desc
+                limit %s
+                """,
+                [top_users])
+            return DeviceStats(active_devices, active_users, daily, await cur.fetchall())
@@ -0,0 +1,87 @@
+import sys
+from asyncio import wait_for, TimeoutError
+from contextlib import asynccontextmanager
+from logging import getLogger
+from typing import Awaitable, Callable, Iterable, Optional
+from urllib.request import urlopen
+
+from aiohttp import web
+
+log = getLogger(__name__)
+
+HealthCheck = Callable[[], Awaitable[None]]
+
+
+class HealthServer:
+    def __init__(self, check_timeout: float, routes: Iterable[web.RouteDef] = ()):
+        self.__check_timeout = check_timeout
+        self.__check: Optional[HealthCheck] = None
+        self.__app = web.Application()
+        self.__app.router.add_get("/live", self.__live_handler)
+        self.__app.router.add_get("/ready", self.__ready_handler)
+        self.__app.router.add_routes(routes)
+
+    @property
+    def app(self) -> web.Application:
+        return self.__app
+
+    def set_ready(self, check: HealthCheck):
+        self.__check = check
+        log.info("Bot is ready")
+
+    def set_not_ready(self):
+        self.__check = None
+
+    async def __live_handler(self, request: web.Request) -> web.Response:
+        return web.Response(text="alive")
+
+    async def __ready_handler(self, request: web.Request) -> web.Response:
+        if self.__check is None:
+            return web.Response(status=503, text="starting")
+        try:
+            await wait_for(self.__check(), self.__check_timeout)
+        except (Exception, TimeoutError) as e:
+            log.warning(f"Readiness check failed: {e!r}")
+            return web.Response(status=503, text="unhealthy")
+        return web.Response(text="ready")
+
+
+@asynccontextmanager
+async def create_health_server(config, routes: Iterable[web.RouteDef] = ()) -> HealthServer:
+    health_config = config["health"]
+
+    health = HealthServer(health_config["timeout"], routes)
+    runner = web.AppRunner(health.app, access_log=None)
+    await runner.setup()
+    try:
+        site = web.TCPSite(runner, health_config["host"], health_config["port"])
+        await site.start()
+        log.info(f"Health server listening on {health_config['host']}:{health_config['port']}")
+        yield health
+    finally:
+        await runner.cleanup()
+
+
+def probe_ready(config) -> bool:
+    health_config = config["health"]
+
+    # Wildcard addresses can't be connected to, server listening on them is reachable via loopback
+    host = health_config["host"]
+    if host in ("", "0.0.0.0"):
+        host = "127.0.0.1"
+    elif host == "::":
+        host = "::1"
+    if ":" in host:
+        host = f"[{host}]"
+    try:
+        with urlopen(f"http://{host}:{health_config['port']}/ready", timeout=health_config["timeout"] + 1):
+            return True
+    except OSError as e:
+        print(f"Readiness probe failed: {e!r}", file=sys.stderr)
+        return False
+
+
+if __name__ == '__main__':
+    from ovpn_bot.config import load_config
+
+    sys.exit(0 if probe_ready(load_config()) else 1)
@@ -0,0 +1,205 @@
+import json
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging import getLogger, StreamHandler
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue, Empty
+from threading import Lock
+from time import time
+from typing import Optional, Dict, Tuple, List
+
+TEXT_FORMAT = "%(asctime)-15s [%(levelname)-8s] %(name)-20s: %(message)s"
+
+_handler: Optional[StreamHandler] = None
+_listener: Optional["LogListener"] = None
+_update_context = ContextVar("log_update_context", default=(None, None))
+
+
+class UpdateContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.update_id, record.user_id = _update_context.get()
+        return True
+
+
+class RateLimitWindow:
+    __slots__ = ("started", "passed", "suppressed", "last")
+
+    def __init__(self, started: float):
+        self.started = started
+        self.passed = 1
+        self.suppressed = 0
+        self.last: Optional[logging.LogRecord] = None
+
+    def summarize(self) -> logging.LogRecord:
+        last = self.last
+        return logging.makeLogRecord({
+            "name": last.name,
+            "levelno": last.levelno,
+            "levelname": last.levelname,
+            "pathname": last.pathname,
+            "filename": last.filename,
+            "module": last.module,
+            "lineno": last.lineno,
+            "funcName": last.funcName,
+            "msg": "%d similar messages suppressed, last one: %s",
+            "args": (self.suppressed, last.getMessage()),
+            "suppressed": self.suppressed,
+        })
+
+
+class RateLimitFilter(logging.Filter):
+    # Records are limited per call site, so a flood of messages differing
+    # only in user id is collapsed into a single count of suppressed lines.
+    # Counts are reported as summary records by flush() once window of call site expires.
+    def __init__(self, interval: float, burst: int):
+        super(RateLimitFilter, self).__init__()
+        self.__interval = interval
+        self.__burst = burst
+        self.__windows: Dict[Tuple[str, int], RateLimitWindow] = {}
+        self.__expired: List[RateLimitWindow] = []
+        self.__next_expiry = float("inf")
+        self.__lock = Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR or getattr(record, "suppressed", None):
+            return True
+
+        key = (record.pathname, record.lineno)
+        with self.__lock:
+            window = self.__windows.get(key)
+            if window is None or record.created - window.started >= self.__interval:
+                if window is not None and window.suppressed:
+                    self.__expired.append(window)
+                self.__windows[key] = RateLimitWindow(record.created)
+                self.__next_expiry = min(self.__next_expiry, record.created + self.__interval)
+                return True
+            if window.passed < self.__burst:
+                window.passed += 1
+                return True
+            window.suppressed += 1
+            window.last = record
+            return False
+
+    def flush(self, now: float, force: bool = False) -> List[logging.LogRecord]:
+        with self.__lock:
+            expired, self.__expired = self.__expired, []
+            if force or now >= self.__next_expiry:
+                # Expired windows are dropped, so the map holds only recently active call sites
+                self.__next_expiry = float("inf")
+                for key, window in list(self.__windows.items()):
+                    if force or now - window.started >= self.__interval:
+                        del self.__windows[key]
+                        if window.suppressed:
+                            expired.append(window)
+                    else:
+                        self.__next_expiry = min(self.__next_expiry, window.started + self.__interval)
+        return [window.summarize() for window in expired]
+
+
+class LocalQueueHandler(QueueHandler):
+    # Queue is consumed by listener thread of the same process, so records don't have to be
+    # made picklable. QueueHandler.prepare() would format message and traceback on event loop,
+    # here it's left to the listener.
+    def emit(self, record: logging.LogRecord):
+        try:
+            self.enqueue(record)
+        except Exception:
+            self.handleError(record)
+
+
+class LogListener(QueueListener):
+    # Wakes up periodically while queue is idle, so suppressed counts are reported
+    # even when flood from a call site stops
+    def __init__(self, queue, *handlers: logging.Handler, flush_interval: float = 1.0):
+        super(LogListener, self).__init__(queue, *handlers)
+        self.__flush_interval = flush_interval
+        self.__rate_limit: Optional[RateLimitFilter] = None
+
+    def set_rate_limit(self, rate_limit: RateLimitFilter):
+        for handler in self.handlers:
+            handler.addFilter(rate_limit)
+        self.__rate_limit = rate_limit
+
+    def dequeue(self, block: bool) -> logging.LogRecord:
+        while True:
+            try:
+                return self.queue.get(block, self.__flush_interval)
+            except Empty:
+                self.__flush(time())
+
+    def handle(self, record: logging.LogRecord):
+        self.__flush(record.created)
+        super(LogListener, self).handle(record)
+
+    def stop(self):
+        super(LogListener, self).stop()
+        self.__flush(time(), force=True)
+
+    def __flush(self, now: float, force: bool = False):
+        if self.__rate_limit is not None:
+            for summary in self.__rate_limit.flush(now, force):
+                super(LogListener, self).handle(summary)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in ("update_id", "user_id", "suppressed"):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+@contextmanager
+def start_logging():
+    global _handler, _listener
+
+    # Event loop only enqueues records, rate limiting, formatting and writing is done by listener thread
+    queue = SimpleQueue()
+    handler = StreamHandler()
+    handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    queue_handler = LocalQueueHandler(queue)
+    queue_handler.addFilter(UpdateContextFilter())
+    listener = LogListener(queue, handler)
+
+    root = getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(queue_handler)
+    listener.start()
+    _handler, _listener = handler, listener
+    try:
+        yield
+    finally:
+        root.removeHandler(queue_handler)
+        listener.stop()
+        _handler, _listener = None, None
+
+
+def configure_logging(config):
+    logging_config = config["logging"]
+    getLogger().setLevel(logging_config["level"])
+    if logging_config["format"] == "json":
+        _handler.setFormatter(JsonFormatter())
+
+    rate_limit = logging_config["rate_limit"]
+    if rate_limit["burst"] > 0:
+        _listener.set_rate_limit(RateLimitFilter(rate_limit["interval"], rate_limit["burst"]))
+
+
+@contextmanager
+def update_context(update_id: int, user_id: Optional[int]):
+    token = _update_context.set((update_id, user_id))
+    try:
+        yield
+    finally:
+        _update_context.reset(token)
@@ -0,0 +1,146 @@
+from asyncio import open_connection, open_unix_connection, sleep, wait_for, StreamReader, StreamWriter
+from asyncio import TimeoutError as AsyncTimeoutError
+from datetime import datetime, timezone
+from logging import getLogger
+from random import uniform
+from typing import Dict, NamedTuple, Optional, Tuple
+
+log = getLogger(__name__)
+
+RECONNECT_BACKOFF_BASE = 0.5
+RECONNECT_BACKOFF_MAX = 60.0
+
+
+class ClientStatus(NamedTuple):
+    common_name: str
+    real_address: str
+    virtual_address: str
+    bytes_received: int
+    bytes_sent: int
+    connected_since: datetime
+
+
+class ManagementError(Exception):
+    pass
+
+
+# Parses "status 3" output line by line as it arrives
+class StatusParser:
+    def __init__(self):
+        self.__columns: Dict[str, int] = {}
+        self.__clients: Dict[str, ClientStatus] = {}
+
+    @property
+    def clients(self) -> Dict[str, ClientStatus]:
+        return self.__clients
+
+    def feed(self, line: str) -> bool:
+        if line == "END":
+            return True
+        if line.startswith("ERROR:"):
+            raise ManagementError(line)
+
+        fields = line.split("\t")
+        if fields[0] == "HEADER" and len(fields) > 1 and fields[1] == "CLIENT_LIST":
+            self.__columns = {name: index for index, name in enumerate(fields[1:])}
+        elif fields[0] == "CLIENT_LIST" and self.__columns:
+            client = self.__parse_client(fields)
+            self.__clients[client.common_name] = client
+        return False
+
+    def __parse_client(self, fields) -> ClientStatus:
+        def field(name: str) -> str:
+            index = self.__columns.get(name)
+            return fields[index] if index is not None and index < len(fields) else ""
+
+        return ClientStatus(
+            field("Common Name"),
+            field("Real Address"),
+            field("Virtual Address"),
+            int(field("Bytes Received") or 0),
+            int(field("Bytes Sent") or 0),
+            datetime.fromtimestamp(int(field("Connected Since (time_t)") or 0), timezone.utc))
+
+
+class ManagementPoller:
+    def __init__(
+            self,
+            host: Optional[str],
+            port: int,
+            socket: Optional[str],
+            password: Optional[str],
+            interval: float,
+            timeout: float
+    ):
+        self.__host = host
+        self.__port = port
+        self.__socket = socket
+        self.__password = password
+        self.__interval = interval
+        self.__timeout = timeout
+        self.__clients: Dict[str, ClientStatus] = {}
+        self.__updated_at: Optional[datetime] = None
+        log.info("Management poller created")
+
+    @property
+    def is_available(self) -> bool:
+        return self.__updated_at is not None
+
+    @property
+    def updated_at(self) -> Optional[datetime]:
+        return self.__updated_at
+
+    @property
+    def clients(self) -> Dict[str, ClientStatus]:
+        return self.__clients
+
+    def get_client(self, common_name: str) -> Optional[ClientStatus]:
+        return self.__clients.get(common_name)
+
+    async def __connect(self) -> Tuple[StreamReader, StreamWriter]:
+        if self.__socket:
+            reader, writer = await wait_for(open_unix_connection(self.__socket), self.__timeout)
+        else:
+            reader, writer = await wait_for(open_connection(self.__host, self.__port), self.__timeout)
+        if self.__password:
+            writer.write(f"{self.__password}\n".encode("utf-8"))
+        return reader, writer
+
+    async def poll(self, reader: StreamReader, writer: StreamWriter) -> Dict[str, ClientStatus]:
+        writer.write(b"status 3\n")
+        await writer.drain()
+
+        parser = StatusParser()
+        while True:
+            raw_line = await wait_for(reader.readline(), self.__timeout)
+            if not raw_line:
+                raise ManagementError("Management interface closed connection")
+            line = raw_line.decode("utf-8", errors="replace").rstrip("\r\n")
+            # Real-time notifications and password prompt replies may be interleaved with status
+            if line.startswith(">") or line.startswith("SUCCESS:") or line.startswith("ENTER PASSWORD:"):
+                continue
+            if parser.feed(line):
+                return parser.clients
+
+    async def run(self):
+        attempt = 0
+        while True:
+            writer = None
+            try:
+                reader, writer = await self.__connect()
+                log.info("Connected to OpenVPN management interface")
+                while True:
+                    # Swapped as a whole, readers never see partially parsed status
+                    self.__clients = await self.poll(reader, writer)
+                    self.__updated_at = datetime.now(timezone.utc)
+                    attempt = 0
+                    await sleep(self.__interval)
+            except (OSError, EOFError, ValueError, ManagementError, AsyncTimeoutError) as e:
+                log.warning(f"OpenVPN management interface is unavailable: {e!r}")
+            finally:
+                if writer is not None:
+                    writer.close()
+            self.__clients = {}
+            self.__updated_at = None
+            await sleep(uniform(0, min(RECONNECT_BACKOFF_MAX, RECONNECT_BACKOFF_BASE * 2 ** attempt)))
+            attempt += 1
@@ -0,0 +1,211 @@
+import logging
+import os
+import sys
+from asyncio import Future, get_event_loop, sleep, ensure_future, gather, shield
+from cProfile import Profile
+from collections import Counter
+from datetime import datetime
+from logging import getLogger
+from threading import Thread, Event, get_ident
+from time import monotonic
+from typing import List, NamedTuple, Optional
+
+from aiohttp import web
+
+log = getLogger(__name__)
+
+MODES = ("cprofile", "sampling")
+LAG_PROBE_INTERVAL = 0.05
+LOCAL_ADDRESSES = ("127.0.0.1", "::1")
+
+
+class ProfilerError(Exception):
+    pass
+
+
+class ProfileResult(NamedTuple):
+    mode: str
+    duration: float
+    files: List[str]
+    samples: int
+    max_loop_lag: float
+    mean_loop_lag: float
+    slow_callbacks: int
+
+
+class SlowCallbackCollector(logging.Handler):
+    # asyncio debug mode reports callbacks slower than loop.slow_callback_duration
+    # as "Executing <Handle ...> took N seconds", handle repr names the coroutine
+    def __init__(self):
+        super(SlowCallbackCollector, self).__init__(logging.WARNING)
+        self.messages: List[str] = []
+
+    def emit(self, record: logging.LogRecord):
+        # Records of asyncio logger may carry non-string messages, e.g. exceptions
+        try:
+            message = record.getMessage()
+        except Exception:
+            self.handleError(record)
+            return
+        if message.startswith("Executing"):
+            self.messages.append(f"{datetime.fromtimestamp(record.created):%H:%M:%S.%f} {message}")
+
+
+class StackSampler:
+    def __init__(self, thread_id: int, interval: float):
+        self.__thread_id = thread_id
+        self.__interval = interval
+        self.__stopped = Event()
+        self.__stacks = Counter()
+        self.__thread = Thread(target=self.__run, name="stack-sampler", daemon=True)
+
+    @property
+    def stacks(self) -> Counter:
+        return self.__stacks
+
+    def start(self):
+        self.__thread.start()
+
+    def stop(self):
+        self.__stopped.set()
+        self.__thread.join()
+
+    def __run(self):
+        while not self.__stopped.wait(self.__interval):
+            frame = sys._current_frames().get(self.__thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.__stacks[";".join(reversed(stack))] += 1
+
+
+class Profiler:
+    def __init__(self, directory: str, sampling_interval: float, slow_callback: float, max_duration: float):
+        self.__directory = directory
+        self.__sampling_interval = sampling_interval
+        self.__slow_callback = slow_callback
+        self.__max_duration = max_duration
+        self.__running = False
+
+    @property
+    def is_running(self) -> bool:
+        return self.__running
+
+    def start(self, duration: float, mode: str) -> Future:
+        if mode not in MODES:
+            raise ProfilerError(f"Unknown profiling mode {mode}, use one of: {', '.join(MODES)}")
+        if not 0 < duration <= self.__max_duration:
+            raise ProfilerError(f"Duration should be between 0 and {self.__max_duration} seconds")
+        if self.__running:
+            raise ProfilerError("Profiling is already running")
+
+        self.__running = True
+        return ensure_future(self.__profile(duration, mode))
+
+    async def __profile(self, duration: float, mode: str) -> ProfileResult:
+        try:
+            return await self.__run(duration, mode)
+        finally:
+            self.__running = False
+
+    async def __run(self, duration: float, mode: str) -> ProfileResult:
+        loop = get_event_loop()
+        prefix = os.path.join(self.__directory, f"{mode}-{datetime.now():%Y%m%d-%H%M%S}")
+        log.info(f"Profiling with {mode} for {duration}s")
+
+        collector = SlowCallbackCollector()
+        asyncio_logger = getLogger("asyncio")
+        debug, slow_callback_duration = loop.get_debug(), loop.slow_callback_duration
+        asyncio_logger.addHandler(collector)
+        loop.slow_callback_duration = self.__slow_callback
+        loop.set_debug(True)
+
+        profile, sampler = None, None
+        if mode == "cprofile":
+            profile = Profile()
+            profile.enable()
+        else:
+            sampler = StackSampler(get_ident(), self.__sampling_interval)
+            sampler.start()
+
+        lags = []
+        lag_probe = ensure_future(self.__probe_lag(lags))
+        try:
+            await sleep(duration)
+        finally:
+            lag_probe.cancel()
+            await gather(lag_probe, return_exceptions=True)
+            if profile is not None:
+                profile.disable()
+            if sampler is not None:
+                await loop.run_in_executor(None, sampler.stop)
+            loop.set_debug(debug)
+            loop.slow_callback_duration = slow_callback_duration
+            asyncio_logger.removeHandler(collector)
+
+        files = await loop.run_in_executor(None, self.__write_files, prefix, profile, sampler, collector)
+        result = ProfileResult(
+            mode,
+            duration,
+            files,
+            sum(sampler.stacks.values()) if sampler is not None else 0,
+            max(lags, default=0.0),
+            sum(lags) / len(lags) if lags else 0.0,
+            len(collector.messages))
+        log.info(f"Profiling finished: {result}")
+        return result
+
+    @staticmethod
+    async def __probe_lag(lags: List[float]):
+        while True:
+            expected = monotonic() + LAG_PROBE_INTERVAL
+            await sleep(LAG_PROBE_INTERVAL)
+            lags.append(max(0.0, monotonic() - expected))
+
+    def __write_files(
+            self,
+            prefix: str,
+            profile: Optional[Profile],
+            sampler: Optional[StackSampler],
+            collector: SlowCallbackCollector
+    ) -> List[str]:
+        os.makedirs(self.__directory, exist_ok=True)
+        files = []
+        if profile is not None:
+            profile.dump_stats(f"{prefix}.pstats")
+            files.append(f"{prefix}.pstats")
+        if sampler is not None:
+            with open(f"{prefix}.collapsed", "w") as file:
+                for stack, count in sampler.stacks.most_common():
+                    file.write(f"{stack} {count}\n")
+            files.append(f"{prefix}.collapsed")
+        if collector.messages:
+            with open(f"{prefix}.slow.log", "w") as file:
+                file.write("\n".join(collector.messages) + "\n")
+            files.append(f"{prefix}.slow.log")
+        return files
+
+    def routes(self) -> List[web.RouteDef]:
+        return [web.post("/profile", self.__profile_handler)]
+
+    async def __profile_handler(self, request: web.Request) -> web.Response:
+        if request.remote not in LOCAL_ADDRESSES:
+            return web.json_response({"error": "Profiling is available from localhost only"}, status=403)
+        try:
+            profile = self.start(float(request.query.get("seconds", 10)), request.query.get("mode", "sampling"))
+        except (ProfilerError, ValueError) as e:
+            return web.json_response({"error": str(e)}, status=400)
+        # Client disconnect cancels the handler, profile must still finish and write its files
+        return web.json_response((await shield(profile))._asdict())
+
+
+def create_profiler(config) -> Profiler:
+    profiling_config = config["profiling"]
+    return Profiler(
+        profiling_config["directory"],
+        profiling_config["sampling_interval"],
+        profiling_config["slow_callback"],
+        profiling_config["max_duration"])
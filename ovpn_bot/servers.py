@@ -0,0 +1,144 @@
+from asyncio import ensure_future, gather
+from logging import getLogger
+from typing import List, Optional, Tuple
+
+from ovpn_bot.management import ManagementPoller, ClientStatus
+
+log = getLogger(__name__)
+
+
+class VPNServer:
+    def __init__(
+            self,
+            host: str,
+            port: int,
+            weight: float,
+            region: Optional[str],
+            management_poller: Optional[ManagementPoller]
+    ):
+        self.__host = host
+        self.__port = port
+        self.__weight = weight
+        self.__region = region
+        self.__management_poller = management_poller
+
+    @property
+    def host(self) -> str:
+        return self.__host
+
+    @property
+    def port(self) -> int:
+        return self.__port
+
+    @property
+    def weight(self) -> float:
+        return self.__weight
+
+    @property
+    def region(self) -> Optional[str]:
+        return self.__region
+
+    @property
+    def management_poller(self) -> Optional[ManagementPoller]:
+        return self.__management_poller
+
+    @property
+    def is_healthy(self) -> bool:
+        # Server without management interface can't be checked, so it's trusted
+        return self.__management_poller is None or self.__management_poller.is_available
+
+    @property
+    def clients_count(self) -> int:
+        return 0 if self.__management_poller is None else len(self.__management_poller.clients)
+
+    @property
+    def load(self) -> float:
+        return self.clients_count / self.__weight if self.__weight > 0 else float("inf")
+
+
+class ServerPool:
+    def __init__(self, servers: List[VPNServer], remote_random: bool):
+        self.__servers = servers
+        self.__remote_random = remote_random
+        self.__tasks = []
+        self.__ordered_key = None
+        self.__ordered_servers = list(servers)
+        log.info(f"Server pool created with {len(servers)} servers")
+
+    @property
+    def remote_random(self) -> bool:
+        return self.__remote_random
+
+    def start(self):
+        self.__tasks = [
+            ensure_future(server.management_poller.run())
+            for server in self.__servers
+            if server.management_poller is not None]
+
+    async def stop(self):
+        for task in self.__tasks:
+            task.cancel()
+        await gather(*self.__tasks, return_exceptions=True)
+        self.__tasks = []
+
+    def __status_key(self) -> Tuple:
+        return tuple(
+            None if server.management_poller is None else server.management_poller.updated_at
+            for server in self.__servers)
+
+    def ordered_servers(self) -> List[VPNServer]:
+        # Order changes only when some server reports new status, so it's recomputed only then
+        key = self.__status_key()
+        if key != self.__ordered_key:
+            self.__ordered_servers = sorted(
+                self.__servers,
+                key=lambda server: (not server.is_healthy, server.load))
+            self.__ordered_key = key
+        return self.__ordered_servers
+
+    def is_status_available(self) -> bool:
+        return any(
+            server.management_poller is not None and server.management_poller.is_available
+            for server in self.__servers)
+
+    def get_client(self, common_name: str) -> Optional[ClientStatus]:
+        for server in self.__servers:
+            if server.management_poller is not None:
+                client = server.management_poller.get_client(common_name)
+                if client is not None:
+                    return client
+        return None
+
+
+def create_management_poller(management_config) -> Optional[ManagementPoller]:
+    if not management_config["host"] and not management_config["socket"]:
+        return None
+    return ManagementPoller(
+        management_config["host"],
+        management_config["port"],
+        management_config["socket"],
+        management_config["password"],
+        management_config["interval"],
+        management_config["timeout"])
+
+
+def create_server_pool(config) -> ServerPool:
+    servers_config = config["servers"]
+    if not servers_config:
+        # Single server configured with "server" and "management" blocks
+        servers_config = [{
+            **config["server"],
+            "weight": 1.0,
+            "region": None,
+            "management": config["management"]
+        }]
+
+    servers = [
+        VPNServer(
+            server_config["host"],
+            server_config["port"],
+            server_config["weight"],
+            server_config["region"],
+            create_management_poller(server_config["management"]))
+        for server_config in servers_config]
+    return ServerPool(servers, config["balancing"]["remote_random"])
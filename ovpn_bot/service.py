@@ -1,21 +1,49 @@
 import textwrap
-from asyncio import sleep
-from asyncio import wait_for
-from contextlib import asynccontextmanager
+from asyncio import sleep, ensure_future, gather, get_event_loop, Lock
+from asyncio import wait_for, TimeoutError as AsyncTimeoutError
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from contextlib import asynccontextmanager, AsyncExitStack
+from datetime import datetime
 from io import BytesIO
 from logging import getLogger
-from typing import List, Union
+from random import uniform
+from typing import List, Union, Optional, NamedTuple, Tuple, Type
 from uuid import UUID
 
 from aiopg import connect, create_pool
 from emoji import demojize
-from psycopg2.errors import UniqueViolation, OperationalError
+from psycopg2.errors import OperationalError
 
+from ovpn_bot.archiver import DeviceArchiver
+from ovpn_bot.audit import AuditLog
 from ovpn_bot.certs import CertManager, dump_key, dump_cert_req, dump_cert, create_cert_manager
-from ovpn_bot.dao import DeviceRepository, Device
+from ovpn_bot.config import load_config
+from ovpn_bot.dao import DeviceRepository, AiopgDeviceRepository, Device, AuditEvent, DeviceStats, DuplicateKeyError
+from ovpn_bot.management import ClientStatus
+from ovpn_bot.servers import ServerPool, create_server_pool
+from ovpn_bot.startup import StartupTimings, gather_fail_fast
+from ovpn_bot.tracing import traced
 
 log = getLogger(__name__)
 
+DB_WAIT_BACKOFF_BASE = 0.1
+DB_WAIT_BACKOFF_MAX = 5.0
+
+
+def compact_uuid(value: UUID) -> str:
+    return urlsafe_b64encode(value.bytes).rstrip(b"=").decode("ascii")
+
+
+def expand_uuid(value: str) -> UUID:
+    # Buttons sent before compact ids were introduced still carry canonical form
+    if len(value) == 36:
+        return UUID(value)
+    return UUID(bytes=urlsafe_b64decode(value + "=" * (-len(value) % 4)))
+
+
+def device_common_name(user_id: int, name: str) -> str:
+    return f"{user_id} {demojize(name)}"
+
 
 def maybe_uuid(value):
     if isinstance(value, UUID):
@@ -36,6 +64,12 @@ class NamedBytesIO(BytesIO):
         return self.__name
 
 
+class DevicesPage(NamedTuple):
+    devices: List[Device]
+    has_prev: bool
+    has_next: bool
+
+
 class VPNServiceError(Exception):
     pass
 
@@ -48,51 +82,127 @@ class DeviceNotFoundError(VPNServiceError):
     pass
 
 
+class VPNSettings(NamedTuple):
+    cert_manager: CertManager
+    max_devices: int
+    server_pool: ServerPool
+
+
+def create_vpn_settings(config, cert_manager: CertManager, server_pool: ServerPool) -> VPNSettings:
+    return VPNSettings(cert_manager, config["default"]["max_devices"], server_pool)
+
+
+def get_servers_config(config):
+    return config["servers"], config["server"], config["management"], config["balancing"]
+
+
 class VPNService:
     def __init__(
             self,
             device_repository: DeviceRepository,
-            cert_manager: CertManager,
-            max_devices: int,
-            server_host: str,
-            server_port: int
+            settings: VPNSettings,
+            audit_log: AuditLog,
+            config
     ):
         self.__device_repository = device_repository
-        self.__cert_manager = cert_manager
-        self.__max_devices = max_devices
-        self.__server_host = server_host
-        self.__server_port = server_port
+        self.__settings = settings
+        self.__audit_log = audit_log
+        self.__db_config = config["database"]
+        self.__servers_config = get_servers_config(config)
+        self.__reload_lock = Lock()
         log.info("VPN service created")
 
+    def start(self):
+        self.__settings.server_pool.start()
+
+    async def reload(self, config):
+        async with self.__reload_lock:
+            db_config = config["database"]
+            servers_config = get_servers_config(config)
+            old_server_pool = self.__settings.server_pool
+            server_pool = old_server_pool if servers_config == self.__servers_config else create_server_pool(config)
+            settings = create_vpn_settings(config, await load_cert_manager(config), server_pool)
+            if db_config["backend"] != self.__db_config["backend"]:
+                log.warning("Database backend can't be changed without restart, database settings are ignored")
+            elif db_config != self.__db_config:
+                await wait_for_db(db_config)
+                # Requests still holding connections of the old pool finish before it's closed
+                await self.__device_repository.replace_pool(await open_db_pool(db_config))
+                self.__db_config = db_config
+                log.info("Database pool replaced")
+            if server_pool is not old_server_pool:
+                server_pool.start()
+            # Single reference assignment, so every request sees either old or new settings
+            self.__settings = settings
+            self.__servers_config = servers_config
+            if server_pool is not old_server_pool:
+                await old_server_pool.stop()
+                log.info("Server pool replaced")
+            log.info("VPN service reloaded")
+
+    async def close(self):
+        await self.__settings.server_pool.stop()
+
+    async def check_health(self):
+        await self.__device_repository.ping()
+
     def get_device_quota(self) -> int:
-        return self.__max_devices
+        return self.__settings.max_devices
 
+    @traced("service.has_device_quota")
     async def has_device_quota(self, user_id: int) -> bool:
-        return await self.__device_repository.count(user_id) < self.__max_devices
+        max_devices = self.__settings.max_devices
+        return await self.__device_repository.count(user_id) < max_devices
 
+    @traced("service.list_devices")
     async def list_devices(self, user_id: int) -> List[Device]:
         return await self.__device_repository.list(user_id)
 
+    @traced("service.list_devices_page")
+    async def list_devices_page(
+            self,
+            user_id: int,
+            cursor: Optional[UUID] = None,
+            forward: bool = True,
+            limit: int = 10
+    ) -> DevicesPage:
+        # One extra row tells whether there is one more page in the requested direction
+        devices = await self.__device_repository.list_page(user_id, cursor, forward, limit + 1)
+        if not devices and cursor is not None:
+            # Cursor device was archived or the rest of the page was removed since the page was shown
+            return await self.list_devices_page(user_id, None, forward, limit)
+        has_more = len(devices) > limit
+        # Without cursor the first page is requested forward and the last one backward
+        if forward:
+            return DevicesPage(devices[:limit], cursor is not None, has_more)
+        else:
+            return DevicesPage(devices[-limit:], has_more, cursor is not None)
+
+    @traced("service.create_device")
     async def create_device(self, user_id: int, name: str) -> Device:
-        pkey = self.__cert_manager.create_private_key()
+        cert_manager = self.__settings.cert_manager
+        pkey = cert_manager.create_private_key()
 
-        common_name = f"{user_id} {demojize(name)}"
-        cert_req = self.__cert_manager.create_certificate_request(common_name, pkey)
+        common_name = device_common_name(user_id, name)
+        cert_req = cert_manager.create_certificate_request(common_name, pkey)
 
         serial_number = await self.__device_repository.next_cert_sn()
-        cert = self.__cert_manager.sign_certificate_request(cert_req, serial_number)
+        cert = cert_manager.sign_certificate_request(cert_req, serial_number)
 
         try:
-            return await self.__device_repository.create(
+            device = await self.__device_repository.create(
                 user_id,
                 name,
                 dump_key(pkey),
                 dump_cert_req(cert_req),
                 dump_cert(cert),
                 serial_number)
-        except UniqueViolation as e:
+        except DuplicateKeyError as e:
             raise DeviceDuplicatedError from e
+        self.__audit_log.record(user_id, "create", device.id, name=device.name, cert_sn=device.cert_sn)
+        return device
 
+    @traced("service.get_device")
     async def get_device(self, user_id: int, device_id: Union[str, UUID]) -> Device:
         device_id = maybe_uuid(device_id)
         device = await self.__device_repository.get(user_id, device_id)
@@ -101,21 +211,53 @@ class VPNService:
         else:
             return device
 
+    @traced("service.remove_device")
     async def remove_device(self, user_id: int, device_id: Union[str, UUID]) -> Device:
         device_id = maybe_uuid(device_id)
         device = await self.__device_repository.remove(user_id, device_id)
         if device is None:
             raise DeviceNotFoundError
         else:
+            self.__audit_log.record(user_id, "remove", device.id, name=device.name, cert_sn=device.cert_sn)
             return device
 
+    async def get_stats(self, days: int = 7, top_users: int = 5) -> DeviceStats:
+        return await self.__device_repository.stats(days, top_users)
+
+    async def list_audit_events(
+            self,
+            since: datetime,
+            until: datetime,
+            user_id: Optional[int] = None,
+            limit: int = 30
+    ) -> List[AuditEvent]:
+        return await self.__audit_log.list_events(since, until, user_id, limit)
+
+    def get_audit_queue_stats(self) -> Tuple[int, int]:
+        return self.__audit_log.queue_depth, self.__audit_log.dropped
+
+    def is_connection_status_available(self) -> bool:
+        return self.__settings.server_pool.is_status_available()
+
+    def get_connection_status(self, device: Device) -> Optional[ClientStatus]:
+        return self.__settings.server_pool.get_client(device_common_name(device.user_id, device.name))
+
+    @traced("service.generate_device_config")
     async def generate_device_config(self, user_id: int, device_id: Union[str, UUID]) -> NamedBytesIO:
+        settings = self.__settings
         device = await self.get_device(user_id, device_id)
+        server_pool = settings.server_pool
+        remotes = [
+            f"remote {server.host} {server.port}" + (f" # {server.region}" if server.region else "")
+            for server in server_pool.ordered_servers()]
+        if server_pool.remote_random:
+            remotes.append("remote-random")
+        remotes_block = textwrap.indent("\n".join(remotes), " " * 12).strip()
         content = textwrap.dedent(f"""
             client
             dev tun
             proto tcp
-            remote {self.__server_host} {self.__server_port}
+            {remotes_block}
             resolv-retry infinite
             nobind
             user nobody
@@ -138,75 +280,155 @@ class VPNService:
             ; down-pre
             ; dhcp-option DOMAIN-ROUTE .
 
-            <ca>\n{textwrap.indent(self.__cert_manager.dump_ca().strip(), " " * 12)}
+            <ca>\n{textwrap.indent(settings.cert_manager.dump_ca().strip(), " " * 12)}
             </ca>
-            <cert>\n{textwrap.indent(device.cert.strip(), " " * 12)}
+            <cert>\n{textwrap.indent(device.cert_pem.strip(), " " * 12)}
             </cert>
-            <key>\n{textwrap.indent(device.pkey.strip(), " " * 12)}
+            <key>\n{textwrap.indent(device.pkey_pem.strip(), " " * 12)}
             </key>
-            <tls-auth>\n{textwrap.indent(self.__cert_manager.dump_tls_auth().strip(), " " * 12)}
+            <tls-auth>\n{textwrap.indent(settings.cert_manager.dump_tls_auth().strip(), " " * 12)}
             </tls-auth>
         """).strip()
+        self.__audit_log.record(user_id, "download_config", device.id, name=device.name)
         return NamedBytesIO(content.encode("utf-8"), demojize(device.name) + ".ovpn")
 
 
+async def probe_db(db_config):
+    if db_config["backend"] == "asyncpg":
+        from ovpn_bot import asyncpg_dao
+        return await asyncpg_dao.probe(db_config)
+
+    async with connect(
+            host=db_config["host"],
+            port=db_config["port"],
+            dbname=db_config["name"],
+            user=db_config["username"],
+            password=db_config["password"],
+            timeout=db_config["timeout"]
+    ) as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT 1")
+
+
+def db_connection_errors(db_config) -> Tuple[Type[BaseException], ...]:
+    if db_config["backend"] == "asyncpg":
+        from ovpn_bot import asyncpg_dao
+        return asyncpg_dao.CONNECTION_ERRORS
+    return OSError, OperationalError, AsyncTimeoutError
+
+
 async def wait_for_db(db_config):
+    connection_errors = db_connection_errors(db_config)
+
     holder = type("", (), {})()
     holder.error = None
 
     async def do_connect():
+        attempt = 0
         while True:
             try:
-                async with connect(
-                        host=db_config["host"],
-                        port=db_config["port"],
-                        dbname=db_config["name"],
-                        user=db_config["username"],
-                        password=db_config["password"],
-                        timeout=db_config["timeout"]
-                ) as conn:
-                    async with conn.cursor() as cur:
-                        await cur.execute("SELECT 1")
+                await probe_db(db_config)
                 break
-            except (OSError, OperationalError) as e:
+            except connection_errors as e:
                 holder.error = e
-                await sleep(0.5)
+                # Exponential backoff with full jitter
+                await sleep(uniform(0, min(DB_WAIT_BACKOFF_MAX, DB_WAIT_BACKOFF_BASE * 2 ** attempt)))
+                attempt += 1
 
     try:
         return await wait_for(do_connect(), db_config["wait"])
-    except TimeoutError:
+    except AsyncTimeoutError:
         raise TimeoutError('Waited too long for the database.') from holder.error
 
 
-@asynccontextmanager
-async def create_vpn_service(config) -> VPNService:
-    db_config = config["database"]
+async def open_db_pool(db_config):
+    if db_config["backend"] == "asyncpg":
+        from ovpn_bot import asyncpg_dao
+        return await asyncpg_dao.open_pool(db_config)
+
     db_pool = db_config["pool"]
-    server_config = config["server"]
-    default_config = config["default"]
+    # Pool opens minsize connections before it's returned
+    pool = await create_pool(
+        host=db_config["host"],
+        port=db_config["port"],
+        dbname=db_config["name"],
+        user=db_config["username"],
+        password=db_config["password"],
+        timeout=db_config["timeout"],
+        minsize=db_pool["minsize"],
+        maxsize=db_pool["maxsize"],
+        pool_recycle=db_pool["recycle"])
+    log.info(f"Database pool created with {pool.size} connections")
+    return pool
 
-    cert_manager = create_cert_manager(config)
-    log.info("Cert manager created")
 
+@asynccontextmanager
+async def create_db_pool(db_config):
     log.info("Waiting for database...")
     await wait_for_db(db_config)
-    async with create_pool(
-            host=db_config["host"],
-            port=db_config["port"],
-            dbname=db_config["name"],
-            user=db_config["username"],
-            password=db_config["password"],
-            timeout=db_config["timeout"],
-            minsize=db_pool["minsize"],
-            maxsize=db_pool["maxsize"],
-            pool_recycle=db_pool["recycle"]
-    ) as pool:
-        device_repository = DeviceRepository(pool)
-        log.info("Database pool created")
-
-        yield VPNService(
+    async with await open_db_pool(db_config) as pool:
+        yield pool
+
+
+def create_device_repository(db_config, pool) -> DeviceRepository:
+    if db_config["backend"] == "asyncpg":
+        from ovpn_bot.asyncpg_dao import AsyncpgDeviceRepository
+        return AsyncpgDeviceRepository(pool)
+    return AiopgDeviceRepository(pool)
+
+
+async def load_cert_manager(config) -> CertManager:
+    cert_manager = await get_event_loop().run_in_executor(None, create_cert_manager, config)
+    log.info("Cert manager created")
+    return cert_manager
+
+
+@asynccontextmanager
+async def create_vpn_service(config, timings: Optional[StartupTimings] = None) -> VPNService:
+    db_config = config["database"]
+    archive_config = config["archive"]
+    audit_config = config["audit"]
+    timings = timings or StartupTimings()
+
+    async with AsyncExitStack() as stack:
+        cert_manager, pool = await gather_fail_fast(
+            timings.timed("pki", load_cert_manager(config)),
+            timings.timed("database", stack.enter_async_context(create_db_pool(db_config))))
+
+        device_repository = create_device_repository(db_config, pool)
+        # Pool may be replaced on reload, the original one is closed by create_db_pool
+        stack.push_async_callback(device_repository.close)
+
+        archiver = DeviceArchiver(
+            device_repository,
+            archive_config["retention"],
+            archive_config["interval"],
+            archive_config["batch_size"],
+            archive_config["pause"])
+        archiver_task = ensure_future(archiver.run())
+
+        audit_log = AuditLog(
+            device_repository,
+            audit_config["queue_size"],
+            audit_config["batch_size"],
+            audit_config["flush_interval"])
+        audit_log.start()
+
+        vpn_service = VPNService(
             device_repository,
-            cert_manager,
-            default_config["max_devices"],
-            server_config["host"],
-            server_config["port"])
+            create_vpn_settings(config, cert_manager, create_server_pool(config)),
+            audit_log,
+            config)
+        vpn_service.start()
+        try:
+            yield vpn_service
+        finally:
+            archiver_task.cancel()
+            await gather(archiver_task, return_exceptions=True)
+            await vpn_service.close()
+            await audit_log.stop()
+
+
+async def reload_vpn_service(vpn_service: VPNService):
+    log.info("Reloading configuration...")
+    await vpn_service.reload(load_config())
@@ -0,0 +1,45 @@
+from asyncio import ensure_future, wait, gather, FIRST_EXCEPTION
+from contextlib import contextmanager
+from logging import getLogger
+from time import monotonic
+from typing import Awaitable, Dict, List, Any
+
+log = getLogger(__name__)
+
+
+class StartupTimings:
+    def __init__(self):
+        self.__started = monotonic()
+        self.__phases: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        started = monotonic()
+        try:
+            yield
+        finally:
+            self.__phases[name] = monotonic() - started
+
+    async def timed(self, name: str, aw: Awaitable) -> Any:
+        with self.phase(name):
+            return await aw
+
+    def report(self):
+        phases = ", ".join(f"{name} {duration:.3f}s" for name, duration in self.__phases.items())
+        log.info(f"Startup finished in {monotonic() - self.__started:.3f}s ({phases})")
+
+
+async def gather_fail_fast(*aws: Awaitable) -> List[Any]:
+    tasks = [ensure_future(aw) for aw in aws]
+    try:
+        await wait(tasks, return_when=FIRST_EXCEPTION)
+        # Failed task may be followed by still pending ones, so its error is raised first
+        for task in tasks:
+            if task.done() and not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+        return [task.result() for task in tasks]
+    finally:
+        pending = [task for task in tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        await gather(*pending, return_exceptions=True)
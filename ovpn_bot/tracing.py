@@ -0,0 +1,250 @@
+import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from inspect import iscoroutinefunction
+from logging import getLogger
+from os import urandom
+from queue import Queue, Empty, Full
+from random import random
+from threading import Thread
+from time import time_ns
+from typing import Optional, Dict, Any, List
+from urllib.request import Request, urlopen
+
+log = getLogger(__name__)
+
+EXPORT_BATCH_SIZE = 256
+EXPORT_INTERVAL = 1.0
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes", "start", "end", "error")
+
+    def __init__(self, trace_id: str, parent_id: Optional[str], name: str, attributes: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start = time_ns()
+        self.end = None
+        self.error = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "end": self.end,
+            "duration_ms": (self.end - self.start) / 1e6,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class SpanExporter:
+    def export(self, spans: List[Span]):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JsonLinesExporter(SpanExporter):
+    def __init__(self, path: str):
+        self.__file = open(path, "a", encoding="utf-8")
+
+    def export(self, spans: List[Span]):
+        for span in spans:
+            self.__file.write(json.dumps(span.to_dict(), default=str) + "\n")
+        self.__file.flush()
+
+    def close(self):
+        self.__file.close()
+
+
+class OtlpHttpExporter(SpanExporter):
+    def __init__(self, endpoint: str, timeout: float):
+        self.__endpoint = endpoint
+        self.__timeout = timeout
+
+    def export(self, spans: List[Span]):
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "ovpn_bot"}}]},
+                "scopeSpans": [{
+                    "scope": {"name": __name__},
+                    "spans": [self.__otlp_span(span) for span in spans]
+                }]
+            }]
+        }
+        request = Request(
+            self.__endpoint,
+            data=json.dumps(body, default=str).encode("utf-8"),
+            headers={"Content-Type": "application/json"})
+        with urlopen(request, timeout=self.__timeout):
+            pass
+
+    @staticmethod
+    def __otlp_span(span: Span) -> Dict[str, Any]:
+        return {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "parentSpanId": span.parent_id or "",
+            "name": span.name,
+            "startTimeUnixNano": str(span.start),
+            "endTimeUnixNano": str(span.end),
+            "attributes": [{"key": key, "value": {"stringValue": str(value)}} for key, value in span.attributes.items()],
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+
+
+class Tracer:
+    def __init__(self, exporter: SpanExporter, sample_rate: float, queue_size: int):
+        self.__exporter = exporter
+        self.__sample_rate = sample_rate
+        self.__queue: Queue = Queue(maxsize=queue_size)
+        self.__dropped = 0
+        # Export is done in background thread, event loop only enqueues finished spans
+        self.__thread = Thread(target=self.__export_loop, name="span-exporter", daemon=True)
+        self.__thread.start()
+
+    @property
+    def dropped(self) -> int:
+        return self.__dropped
+
+    def is_sampled(self) -> bool:
+        return random() < self.__sample_rate
+
+    def finish(self, span: Span):
+        span.end = time_ns()
+        # Slow or unavailable exporter must not make spans pile up in memory
+        try:
+            self.__queue.put_nowait(span)
+        except Full:
+            self.__dropped += 1
+            if self.__dropped % 1000 == 1:
+                log.warning(f"Span queue is full, {self.__dropped} spans dropped so far")
+
+    def close(self):
+        self.__queue.put(None)
+        self.__thread.join()
+        self.__exporter.close()
+        log.info(f"Tracer stopped, {self.__dropped} spans dropped in total")
+
+    def __export_loop(self):
+        running = True
+        while running:
+            spans = []
+            try:
+                while len(spans) < EXPORT_BATCH_SIZE:
+                    span = self.__queue.get(timeout=EXPORT_INTERVAL if not spans else 0.01)
+                    if span is None:
+                        running = False
+                        break
+                    spans.append(span)
+            except Empty:
+                pass
+            if spans:
+                try:
+                    self.__exporter.export(spans)
+                except Exception:
+                    log.exception(f"Failed to export {len(spans)} spans")
+
+
+_tracer: Optional[Tracer] = None
+_current_span = ContextVar("current_span", default=None)
+
+
+# Shared by all untraced calls, so the disabled path allocates nothing
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+@contextmanager
+def _span_scope(tracer: Tracer, span: Span):
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = repr(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        tracer.finish(span)
+
+
+def trace(name: str, **attributes):
+    tracer = _tracer
+    if tracer is None or not tracer.is_sampled():
+        return _NOOP_SPAN
+    return _span_scope(tracer, Span(urandom(16).hex(), None, name, attributes))
+
+
+def span(name: str, **attributes):
+    parent = _current_span.get()
+    tracer = _tracer
+    if parent is None or tracer is None:
+        return _NOOP_SPAN
+    return _span_scope(tracer, Span(parent.trace_id, parent.span_id, name, attributes))
+
+
+def traced(name: str):
+    def decorator(func):
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                if _current_span.get() is None:
+                    return await func(*args, **kwargs)
+                with span(name):
+                    return await func(*args, **kwargs)
+        else:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if _current_span.get() is None:
+                    return func(*args, **kwargs)
+                with span(name):
+                    return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def configure_tracing(config):
+    global _tracer
+
+    tracing_config = config["tracing"]
+    exporter_name = tracing_config["exporter"]
+    if exporter_name == "jsonl":
+        exporter = JsonLinesExporter(tracing_config["path"])
+    elif exporter_name == "otlp":
+        exporter = OtlpHttpExporter(tracing_config["endpoint"], tracing_config["timeout"])
+    else:
+        log.info("Tracing disabled")
+        yield
+        return
+
+    _tracer = Tracer(exporter, tracing_config["sample_rate"], tracing_config["queue_size"])
+    log.info(f"Tracing enabled with {exporter_name} exporter")
+    try:
+        yield
+    finally:
+        tracer, _tracer = _tracer, None
+        tracer.close()
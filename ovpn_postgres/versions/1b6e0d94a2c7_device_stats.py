@@ -0,0 +1,150 @@
+"""Device stats
+
+Revision ID: 1b6e0d94a2c7
+Revises: f3a8c1d05b72
+Create Date: 2026-10-19 16:48:10.117652
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1b6e0d94a2c7'
+down_revision = 'f3a8c1d05b72'
+branch_labels = None
+depends_on = None
+
+# Totals are spread over rows by user id, so concurrent writes of different users
+# rarely update the same row. Readers sum all shards.
+STATS_SHARDS = 16
+
+
+def upgrade():
+    op.create_table(
+        "user_device_stats",
+        sa.Column("user_id", sa.BIGINT(), nullable=False),
+        sa.Column("active_devices", sa.INTEGER(), nullable=False, server_default=sa.literal(0)),
+        sa.Column("created_devices", sa.INTEGER(), nullable=False, server_default=sa.literal(0)),
+        sa.Column("removed_devices", sa.INTEGER(), nullable=False, server_default=sa.literal(0)),
+
+        sa.PrimaryKeyConstraint("user_id")
+    )
+    op.create_index("ix_user_device_stats_active_devices", "user_device_stats", ("active_devices",))
+
+    op.create_table(
+        "device_stats_daily",
+        sa.Column("day", sa.DATE(), nullable=False),
+        sa.Column("shard", sa.SMALLINT(), nullable=False),
+        sa.Column("created_devices", sa.INTEGER(), nullable=False, server_default=sa.literal(0)),
+        sa.Column("removed_devices", sa.INTEGER(), nullable=False, server_default=sa.literal(0)),
+
+        sa.PrimaryKeyConstraint("day", "shard")
+    )
+
+    op.create_table(
+        "device_stats",
+        sa.Column("shard", sa.SMALLINT(), nullable=False),
+        sa.Column("active_devices", sa.INTEGER(), nullable=False, server_default=sa.literal(0)),
+        sa.Column("active_users", sa.INTEGER(), nullable=False, server_default=sa.literal(0)),
+
+        sa.PrimaryKeyConstraint("shard")
+    )
+
+    op.execute(f"""
+        create function devices_maintain_stats() returns trigger as $$
+        declare
+            delta_active integer := 0;
+            delta_created integer := 0;
+            delta_removed integer := 0;
+            delta_users integer := 0;
+            user_active integer;
+            stats_shard smallint := new.user_id % {STATS_SHARDS};
+        begin
+            if tg_op = 'INSERT' then
+                delta_created := 1;
+                delta_active := case when new.removed then 0 else 1 end;
+                delta_removed := case when new.removed then 1 else 0 end;
+            elsif old.removed is distinct from new.removed then
+                delta_active := case when new.removed then -1 else 1 end;
+                delta_removed := case when new.removed then 1 else -1 end;
+            else
+                return null;
+            end if;
+
+            insert into user_device_stats as s (user_id, active_devices, created_devices, removed_devices)
+            values (new.user_id, delta_active, delta_created, delta_removed)
+            on conflict (user_id) do update set
+                active_devices = s.active_devices + delta_active,
+                created_devices = s.created_devices + delta_created,
+                removed_devices = s.removed_devices + delta_removed
+            returning active_devices into user_active;
+
+            insert into device_stats_daily as d (day, shard, created_devices, removed_devices)
+            values ((current_timestamp at time zone 'UTC')::date, stats_shard, delta_created, greatest(delta_removed, 0))
+            on conflict (day, shard) do update set
+                created_devices = d.created_devices + delta_created,
+                removed_devices = d.removed_devices + greatest(delta_removed, 0);
+
+            -- User starts or stops counting as active when their first device appears or last one is removed
+            delta_users := case
+                when delta_active > 0 and user_active = delta_active then 1
+                when delta_active < 0 and user_active = 0 then -1
+                else 0 end;
+            if delta_active <> 0 then
+                insert into device_stats as s (shard, active_devices, active_users)
+                values (stats_shard, delta_active, delta_users)
+                on conflict (shard) do update set
+                    active_devices = s.active_devices + delta_active,
+                    active_users = s.active_users + delta_users;
+            end if;
+
+            return null;
+        end;
+        $$ language plpgsql
+    """)
+
+    # Writes are blocked while counters are backfilled, so no change slips in between
+    op.execute("lock table devices in share mode")
+    op.execute("""
+        create trigger devices_maintain_stats after insert or update of removed on devices
+        for each row execute procedure devices_maintain_stats()
+    """)
+    op.execute("""
+        insert into user_device_stats (user_id, active_devices, created_devices, removed_devices)
+        select user_id, count(*) filter (where active), count(*), count(*) filter (where not active)
+        from (
+            select user_id, not removed as active from devices
+            union all
+            select user_id, false from devices_archive
+        ) all_devices
+        group by user_id
+    """)
+    op.execute(f"""
+        insert into device_stats_daily (day, shard, created_devices, removed_devices)
+        select day, user_id % {STATS_SHARDS}, sum(created), sum(removed)
+        from (
+            select (created_at at time zone 'UTC')::date as day, user_id, 1 as created, 0 as removed from devices
+            union all
+            select (created_at at time zone 'UTC')::date, user_id, 1, 0 from devices_archive
+            union all
+            select (removed_at at time zone 'UTC')::date, user_id, 0, 1 from devices where removed_at is not null
+            union all
+            select (removed_at at time zone 'UTC')::date, user_id, 0, 1 from devices_archive where removed_at is not null
+        ) events
+        group by 1, 2
+    """)
+    op.execute(f"""
+        insert into device_stats (shard, active_devices, active_users)
+        select user_id % {STATS_SHARDS}, sum(active_devices), count(*) filter (where active_devices > 0)
+        from user_device_stats
+        group by 1
+    """)
+
+
+def downgrade():
+    op.execute("drop trigger devices_maintain_stats on devices")
+    op.execute("drop function devices_maintain_stats()")
+    op.drop_table("device_stats")
+    op.drop_table("device_stats_daily")
+    op.drop_table("user_device_stats")
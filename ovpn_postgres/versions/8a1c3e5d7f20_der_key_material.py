@@ -0,0 +1,102 @@
+"""Store key material as DER
+
+Revision ID: 8a1c3e5d7f20
+Revises: 53f17192bf18
+Create Date: 2026-10-19 10:12:41.503217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a1c3e5d7f20'
+down_revision = '53f17192bf18'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+BATCH_PAUSE = 0.05
+
+COLUMNS = (
+    ("pkey", "PRIVATE KEY"),
+    ("cert_req", "CERTIFICATE REQUEST"),
+    ("cert", "CERTIFICATE"),
+)
+
+
+def pem_to_der(column):
+    return f"decode(regexp_replace({column}, '-----[^-]+-----|\\s', '', 'g'), 'base64')"
+
+
+def der_to_pem(column, label):
+    body = f"regexp_replace(regexp_replace(encode({column}, 'base64'), '\\n', '', 'g'), '(.{{64}})', '\\1\n', 'g')"
+    return f"'-----BEGIN {label}-----\n' || rtrim({body}, '\n') || '\n-----END {label}-----\n'"
+
+
+def backfill(conn, limit):
+    assignments = ", ".join(f"{column}_der = {pem_to_der(column)}" for column, _ in COLUMNS)
+    return conn.execute(sa.text(
+        f"""
+        update devices set {assignments}
+        where id in (select id from devices where pkey_der is null limit :limit for update skip locked)
+        """).bindparams(limit=limit)).rowcount
+
+
+def has_missing(conn):
+    return conn.execute(sa.text("select exists (select 1 from devices where pkey_der is null)")).scalar()
+
+
+def upgrade():
+    # Steps up to the end of backfill are committed separately from the version bump,
+    # so each of them can be repeated when migration is re-run after a failure.
+    for column, _ in COLUMNS:
+        op.execute(f"alter table devices add column if not exists {column}_der bytea")
+
+    # Keeps DER columns in sync for rows written by the bot while backfill is running.
+    assignments = "; ".join(f"new.{column}_der := {pem_to_der(f'new.{column}')}" for column, _ in COLUMNS)
+    op.execute(f"""
+        create or replace function devices_sync_der() returns trigger as $$
+        begin
+            {assignments};
+            return new;
+        end;
+        $$ language plpgsql
+    """)
+    op.execute("drop trigger if exists devices_sync_der on devices")
+    op.execute("""
+        create trigger devices_sync_der before insert or update of pkey, cert_req, cert on devices
+        for each row execute procedure devices_sync_der()
+    """)
+
+    # Backfill in short autocommitted batches so that row locks are held only for a single batch
+    # and the bot keeps serving requests during migration.
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        # Empty batch means either completion or that every remaining row is locked by the bot,
+        # the latter is retried after a pause until those rows are released.
+        while backfill(conn, BATCH_SIZE) or has_missing(conn):
+            conn.execute(sa.text("select pg_sleep(:pause)").bindparams(pause=BATCH_PAUSE))
+
+        # Validated check constraint lets "set not null" below skip the full table scan
+        # under an exclusive lock.
+        for column, _ in COLUMNS:
+            op.execute(f"alter table devices drop constraint if exists chk_devices_{column}_der")
+            op.execute(f"alter table devices add constraint chk_devices_{column}_der "
+                       f"check ({column}_der is not null) not valid")
+            op.execute(f"alter table devices validate constraint chk_devices_{column}_der")
+
+    op.execute("drop trigger devices_sync_der on devices")
+    op.execute("drop function devices_sync_der()")
+    for column, _ in COLUMNS:
+        op.drop_column("devices", column)
+        op.alter_column("devices", f"{column}_der", new_column_name=column, nullable=False)
+        op.drop_constraint(f"chk_devices_{column}_der", "devices")
+
+
+def downgrade():
+    for column, label in COLUMNS:
+        op.add_column("devices", sa.Column(f"{column}_pem", sa.TEXT(), nullable=True))
+        op.execute(f"update devices set {column}_pem = {der_to_pem(column, label)}")
+        op.drop_column("devices", column)
+        op.alter_column("devices", f"{column}_pem", new_column_name=column, nullable=False)
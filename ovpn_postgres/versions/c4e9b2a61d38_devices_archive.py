@@ -0,0 +1,70 @@
+"""Devices archive
+
+Revision ID: c4e9b2a61d38
+Revises: 8a1c3e5d7f20
+Create Date: 2026-10-19 11:40:07.218834
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import UUID
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e9b2a61d38'
+down_revision = '8a1c3e5d7f20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("devices", sa.Column("removed_at", sa.TIMESTAMP(timezone=True), nullable=True))
+
+    # Private key and certificate request are useless once device is removed,
+    # so only the certificate is kept for the record.
+    op.create_table(
+        "devices_archive",
+        sa.Column("id", UUID(), nullable=False),
+        sa.Column("user_id", sa.BIGINT(), nullable=False),
+        sa.Column("name", sa.TEXT(), nullable=False),
+        sa.Column("cert", sa.LargeBinary(), nullable=False),
+        sa.Column("cert_sn", sa.BIGINT(), nullable=False),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column("removed_at", sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column("archived_at", sa.TIMESTAMP(timezone=True), nullable=False, server_default=sa.text("current_timestamp")),
+
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("cert_sn")
+    )
+
+    op.execute("""
+        create function devices_check_archived_cert_sn() returns trigger as $$
+        begin
+            if exists (select 1 from devices_archive where cert_sn = new.cert_sn) then
+                raise unique_violation using message = format('Certificate %s is already archived', new.cert_sn);
+            end if;
+            return new;
+        end;
+        $$ language plpgsql
+    """)
+    op.execute("""
+        create trigger devices_check_archived_cert_sn before insert or update of cert_sn on devices
+        for each row execute procedure devices_check_archived_cert_sn()
+    """)
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_devices_removed_at",
+            "devices",
+            ("removed_at",),
+            postgresql_where=sa.text("removed"),
+            postgresql_concurrently=True
+        )
+
+
+def downgrade():
+    op.drop_index("ix_devices_removed_at", "devices")
+    op.execute("drop trigger devices_check_archived_cert_sn on devices")
+    op.execute("drop function devices_check_archived_cert_sn()")
+    op.drop_table("devices_archive")
+    op.drop_column("devices", "removed_at")
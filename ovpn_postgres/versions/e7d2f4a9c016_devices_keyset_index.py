@@ -0,0 +1,31 @@
+"""Devices keyset index
+
+Revision ID: e7d2f4a9c016
+Revises: c4e9b2a61d38
+Create Date: 2026-10-19 13:05:52.734120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7d2f4a9c016'
+down_revision = 'c4e9b2a61d38'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_devices_user_id_created_at_id",
+            "devices",
+            ("user_id", "created_at", "id"),
+            postgresql_where=sa.text("not removed"),
+            postgresql_concurrently=True
+        )
+
+
+def downgrade():
+    op.drop_index("ix_devices_user_id_created_at_id", "devices")
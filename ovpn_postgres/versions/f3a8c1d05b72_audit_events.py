@@ -0,0 +1,35 @@
+"""Audit events
+
+Revision ID: f3a8c1d05b72
+Revises: e7d2f4a9c016
+Create Date: 2026-10-19 15:21:36.408915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a8c1d05b72'
+down_revision = 'e7d2f4a9c016'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Partitioned by month, partitions are created by the bot before writing into them
+    op.execute("""
+        create table audit_events (
+            created_at timestamp with time zone not null,
+            user_id bigint not null,
+            action text not null,
+            device_id uuid,
+            details jsonb
+        ) partition by range (created_at)
+    """)
+    op.create_index("ix_audit_events_created_at", "audit_events", ("created_at",))
+    op.create_index("ix_audit_events_user_id_created_at", "audit_events", ("user_id", "created_at"))
+
+
+def downgrade():
+    op.drop_table("audit_events")
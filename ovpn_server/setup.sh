@@ -266,6 +266,14 @@ persist-tun
 # and rewritten every minute.
 status /var/log/openvpn/openvpn-status.log
 
+# Management interface polled by the bot for
+# live connection status. Unix socket on a volume
+# shared with the bot only, so neither VPN clients
+# nor other containers can reach it. Connections
+# must authenticate with the password from pw-file.
+management /run/management/openvpn.sock unix /run/secrets/management.password
+management-client-user root
+
 # By default, log messages will go to the syslog (or
 # on Windows, if running as a service, they will go to
 # the "\Program Files\OpenVPN\log" directory).
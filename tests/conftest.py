@@ -0,0 +1,62 @@
+import os
+from contextlib import asynccontextmanager
+from random import randrange
+
+import asyncpg
+import pytest
+
+from ovpn_bot.service import open_db_pool, create_device_repository
+
+
+# Database tests run against migrated schema of PostgreSQL given by libpq environment (PGHOST, PGPORT,
+# PGDATABASE, PGUSER, PGPASSWORD). Counters maintained by triggers keep rows of test users, so it should be
+# a scratch database.
+@pytest.fixture(params=["aiopg", "asyncpg"])
+def db_config(request):
+    if "PGHOST" not in os.environ:
+        pytest.skip("PGHOST isn't set, database tests need migrated PostgreSQL")
+    return {
+        "backend": request.param,
+        "host": os.environ["PGHOST"],
+        "port": int(os.environ.get("PGPORT", 5432)),
+        "name": os.environ.get("PGDATABASE", "postgres"),
+        "username": os.environ.get("PGUSER", "postgres"),
+        "password": os.environ.get("PGPASSWORD", ""),
+        "timeout": 10.0,
+        "wait": 10.0,
+        "pool": {"minsize": 1, "maxsize": 4, "recycle": -1, "idle_lifetime": 300.0}
+    }
+
+
+@pytest.fixture
+def user_id():
+    # Far above Telegram ids, so tests never touch devices of real users
+    return randrange(10 ** 15, 10 ** 16)
+
+
+@pytest.fixture
+def open_repository(db_config):
+    # Pool is bound to event loop, so repository is opened inside of test scenario
+    @asynccontextmanager
+    async def open_repository():
+        repository = create_device_repository(db_config, await open_db_pool(db_config))
+        try:
+            yield repository
+        finally:
+            await repository.close()
+
+    return open_repository
+
+
+@pytest.fixture
+def connect_database(db_config):
+    # Plain connection for checks below repository level
+    async def connect_database() -> asyncpg.Connection:
+        return await asyncpg.connect(
+            host=db_config["host"],
+            port=db_config["port"],
+            database=db_config["name"],
+            user=db_config["username"],
+            password=db_config["password"])
+
+    return connect_database
@@ -0,0 +1,53 @@
+from asyncio import run, sleep, Event
+
+from ovpn_bot.audit import AuditLog
+
+
+class FakeRepository:
+    def __init__(self, insert_delay: float = 0.0):
+        self.insert_delay = insert_delay
+        self.inserting = None
+        self.inserted = []
+
+    async def ensure_audit_partition(self, month):
+        pass
+
+    async def insert_audit_events(self, events):
+        # Insert is committed on server before its result reaches the client
+        self.inserted.extend(events)
+        if self.inserting is not None:
+            self.inserting.set()
+        await sleep(self.insert_delay)
+
+
+def test_stop_flushes_queued_events():
+    repository = FakeRepository()
+
+    async def scenario():
+        audit_log = AuditLog(repository, 100, 10, 10.0)
+        audit_log.start()
+        for user_id in range(25):
+            audit_log.record(user_id, "create")
+        await audit_log.stop()
+
+    run(scenario())
+    assert [event.user_id for event in repository.inserted] == list(range(25))
+
+
+def test_stop_waits_for_in_flight_flush_without_duplicates():
+    repository = FakeRepository(insert_delay=0.2)
+
+    async def scenario():
+        # Queue and event are bound to running loop on Python 3.8
+        repository.inserting = Event()
+        audit_log = AuditLog(repository, 100, 5, 0.01)
+        audit_log.start()
+        for user_id in range(5):
+            audit_log.record(user_id, "create")
+        await repository.inserting.wait()
+        for user_id in range(5, 8):
+            audit_log.record(user_id, "remove")
+        await audit_log.stop()
+
+    run(scenario())
+    assert [event.user_id for event in repository.inserted] == list(range(8))
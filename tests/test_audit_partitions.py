@@ -0,0 +1,59 @@
+from asyncio import run, gather
+from datetime import datetime, timezone
+from random import randrange
+
+import pytest
+
+from ovpn_bot.dao import AuditEvent
+
+
+@pytest.fixture
+def month(connect_database):
+    # Far future month, so test partition never overlaps partitions of real events
+    month = datetime(randrange(2200, 2900), randrange(1, 13), 1, tzinfo=timezone.utc)
+    yield month
+
+    async def drop_partition():
+        conn = await connect_database()
+        try:
+            await conn.execute(f"drop table if exists audit_events_{month:%Y_%m}")
+        finally:
+            await conn.close()
+
+    run(drop_partition())
+
+
+def test_concurrent_partition_creation_from_several_instances(open_repository, month):
+    async def scenario():
+        async with open_repository() as first, open_repository() as second:
+            await gather(*(
+                repository.ensure_audit_partition(month)
+                for _ in range(4)
+                for repository in (first, second)))
+            await first.ensure_audit_partition(month)
+
+    run(scenario())
+
+
+def test_missing_details_are_stored_as_sql_null(open_repository, connect_database, month, user_id):
+    async def scenario():
+        async with open_repository() as repository:
+            await repository.ensure_audit_partition(month)
+            await repository.insert_audit_events([
+                AuditEvent(month, user_id, "create", None, None),
+                AuditEvent(month, user_id, "remove", None, {"name": "Phone"})])
+            events = await repository.list_audit_events(month, month.replace(year=month.year + 1), user_id, 10)
+
+        conn = await connect_database()
+        try:
+            nulls = await conn.fetch(
+                "select action, details is null as is_null from audit_events "
+                "where created_at = $1 and user_id = $2 order by action", month, user_id)
+        finally:
+            await conn.close()
+        return events, [tuple(record) for record in nulls]
+
+    events, nulls = run(scenario())
+    assert sorted((event.action, event.details) for event in events) == [
+        ("create", None), ("remove", {"name": "Phone"})]
+    assert nulls == [("create", True), ("remove", False)]
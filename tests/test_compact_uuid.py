@@ -0,0 +1,15 @@
+from uuid import uuid4
+
+from ovpn_bot.service import compact_uuid, expand_uuid
+
+
+def test_compact_uuid_round_trip():
+    value = uuid4()
+    compact = compact_uuid(value)
+    assert len(compact) == 22
+    assert expand_uuid(compact) == value
+
+
+def test_expand_uuid_accepts_canonical_form():
+    value = uuid4()
+    assert expand_uuid(str(value)) == value
@@ -0,0 +1,35 @@
+import logging
+import sys
+
+import pytest
+
+from ovpn_bot import config
+
+
+@pytest.fixture
+def environment(monkeypatch, tmp_path):
+    monkeypatch.setattr(sys, "argv", ["ovpn_bot"])
+    monkeypatch.setattr(config, "SECRETS_DIR", str(tmp_path / "secrets"))
+    monkeypatch.setenv("VPNBOTDIR", str(tmp_path))
+    monkeypatch.setenv("BOT_TOKEN", "token")
+    monkeypatch.setenv("USERS_GROUP_ID", "-1")
+    (tmp_path / "config.yaml").write_text("default:\n  max_devices: 20\nserver:\n  port: 443\n")
+    return monkeypatch
+
+
+def test_config_file_values_are_loaded(environment):
+    loaded = config.load_config()
+    assert loaded["default"]["max_devices"] == 20
+    assert loaded["server"]["port"] == 443
+
+
+def test_environment_shadowing_config_file_is_reported(environment, caplog):
+    environment.setenv("DEFAULT_MAX_DEVICES", "6")
+    environment.setenv("SERVER_PORT", "443")
+
+    with caplog.at_level(logging.WARNING):
+        loaded = config.load_config()
+
+    assert loaded["default"]["max_devices"] == 6
+    assert "default.max_devices" in caplog.text
+    assert "server.port" not in caplog.text
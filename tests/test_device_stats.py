@@ -0,0 +1,72 @@
+from asyncio import run
+
+import pytest
+
+
+async def totals(repository):
+    stats = await repository.stats(1, 0)
+    created, removed = stats.daily[0][1:] if stats.daily else (0, 0)
+    return stats.active_devices, stats.active_users, created, removed
+
+
+def test_trigger_maintains_device_and_user_counters(open_repository, user_id):
+    async def scenario():
+        async with open_repository() as repository:
+            start = await totals(repository)
+            deltas = []
+
+            async def step(action):
+                result = await action
+                current = await totals(repository)
+                deltas.append(tuple(value - initial for value, initial in zip(current, start)))
+                return result
+
+            first = await step(repository.create(user_id, "first", b"pkey", b"req", b"cert",
+                                                 await repository.next_cert_sn()))
+            second = await step(repository.create(user_id, "second", b"pkey", b"req", b"cert",
+                                                  await repository.next_cert_sn()))
+            await step(repository.remove(user_id, first.id))
+            # Removing already removed device changes nothing
+            await step(repository.remove(user_id, first.id))
+            await step(repository.remove(user_id, second.id))
+            return deltas, await repository.count(user_id)
+
+    deltas, count = run(scenario())
+    # (active devices, active users, created today, removed today) relative to start
+    assert deltas == [
+        (1, 1, 1, 0),
+        (2, 1, 2, 0),
+        (1, 1, 2, 1),
+        (1, 1, 2, 1),
+        (0, 0, 2, 2),
+    ]
+    assert count == 0
+
+
+def test_devices_of_different_users_are_written_without_waiting(db_config, connect_database, user_id):
+    if db_config["backend"] != "asyncpg":
+        pytest.skip("Counters are maintained by database, so one backend is enough")
+
+    insert = """
+        insert into devices (user_id, name, pkey, cert_req, cert, cert_sn)
+        values ($1, 'device', 'pkey', 'req', 'cert', nextval('certs_sn'))
+    """
+
+    async def scenario():
+        first, second = await connect_database(), await connect_database()
+        try:
+            first_transaction = first.transaction()
+            await first_transaction.start()
+            await first.execute(insert, user_id)
+            # Counter rows updated by the first insert stay locked until its transaction ends
+            second_transaction = second.transaction()
+            await second_transaction.start()
+            await second.execute("set local lock_timeout = '1s'")
+            await second.execute(insert, user_id + 1)
+            await second_transaction.rollback()
+            await first_transaction.rollback()
+        finally:
+            await first.close()
+            await second.close()
+
+    run(scenario())
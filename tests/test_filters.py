@@ -0,0 +1,34 @@
+from asyncio import run
+
+import pytest
+from aiogram.types import ChatMember, Message
+
+from ovpn_bot.bot import GroupMemberFilter, GroupAdminFilter
+
+
+class FakeGroup:
+    def __init__(self, statuses):
+        self.statuses = statuses
+
+    async def get_member(self, user_id):
+        return ChatMember(status=self.statuses[user_id])
+
+
+@pytest.mark.parametrize("status,is_member,is_admin", [
+    ("creator", True, True),
+    ("administrator", True, True),
+    ("member", True, False),
+    ("left", False, False),
+    ("kicked", False, False),
+])
+def test_group_filters_check_member_status(caplog, status, is_member, is_admin):
+    group = FakeGroup({42: status})
+    message = Message.to_object({"from": {"id": 42, "is_bot": False, "first_name": "Someone", "username": "someone"}})
+
+    async def check():
+        return await GroupMemberFilter(group).check(message), await GroupAdminFilter(group).check(message)
+
+    with caplog.at_level("INFO"):
+        assert run(check()) == (is_member, is_admin)
+    assert ("Unauthorized access from 42 (someone)" in caplog.text) is not is_member
+    assert ("Unauthorized admin access from 42 (someone)" in caplog.text) is not is_admin
@@ -0,0 +1,68 @@
+from asyncio import run, sleep, get_event_loop
+
+from aiohttp.test_utils import TestServer, TestClient
+
+from ovpn_bot.health import HealthServer, probe_ready
+
+
+def request_statuses(health: HealthServer, *paths: str):
+    async def scenario():
+        async with TestClient(TestServer(health.app)) as client:
+            return [(await client.get(path)).status for path in paths]
+
+    return run(scenario())
+
+
+def test_live_and_not_ready_while_starting():
+    assert request_statuses(HealthServer(1.0), "/live", "/ready") == [200, 503]
+
+
+def test_ready_when_check_passes():
+    async def check():
+        pass
+
+    health = HealthServer(1.0)
+    health.set_ready(check)
+    assert request_statuses(health, "/ready") == [200]
+
+
+def test_not_ready_when_check_fails_or_hangs():
+    async def failing_check():
+        raise ConnectionError("database is down")
+
+    async def hanging_check():
+        await sleep(10)
+
+    for check in (failing_check, hanging_check):
+        health = HealthServer(0.1)
+        health.set_ready(check)
+        assert request_statuses(health, "/ready") == [503]
+
+
+def test_not_ready_after_shutdown_started():
+    async def check():
+        pass
+
+    health = HealthServer(1.0)
+    health.set_ready(check)
+    health.set_not_ready()
+    assert request_statuses(health, "/live", "/ready") == [200, 503]
+
+
+def test_probe_uses_configured_port_and_reaches_wildcard_host_via_loopback():
+    async def check():
+        pass
+
+    async def scenario():
+        health = HealthServer(1.0)
+        async with TestServer(health.app, host="127.0.0.1") as server:
+            def probe(host):
+                config = {"health": {"host": host, "port": server.port, "timeout": 1.0}}
+                # Probe is blocking, so it runs off the loop serving the request
+                return get_event_loop().run_in_executor(None, probe_ready, config)
+
+            results = [await probe("0.0.0.0")]
+            health.set_ready(check)
+            return results + [await probe("0.0.0.0"), await probe("127.0.0.1")]
+
+    assert run(scenario()) == [False, True, True]
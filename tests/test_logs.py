@@ -0,0 +1,126 @@
+import json
+import logging
+import sys
+from queue import SimpleQueue
+from time import sleep, time
+
+from ovpn_bot.logs import RateLimitFilter, LocalQueueHandler, LogListener, JsonFormatter
+
+
+def make_record(created: float, level: int = logging.INFO, lineno: int = 10, msg: str = "Access from %s",
+                args=(1,), exc_info=None) -> logging.LogRecord:
+    record = logging.LogRecord("ovpn_bot.bot", level, "bot.py", lineno, msg, args, exc_info)
+    record.created = created
+    return record
+
+
+class CollectingHandler(logging.Handler):
+    def __init__(self):
+        super(CollectingHandler, self).__init__()
+        self.records = []
+
+    def emit(self, record: logging.LogRecord):
+        self.records.append(record)
+
+
+def test_burst_passes_then_suppresses_per_call_site():
+    rate_limit = RateLimitFilter(60.0, 3)
+    passed = [rate_limit.filter(make_record(100.0 + i, args=(i,))) for i in range(5)]
+    other_site = rate_limit.filter(make_record(104.0, lineno=20))
+
+    assert passed == [True, True, True, False, False]
+    assert other_site
+    assert rate_limit.flush(159.0) == []
+
+
+def test_expired_window_is_flushed_as_summary():
+    rate_limit = RateLimitFilter(60.0, 1)
+    for i in range(4):
+        rate_limit.filter(make_record(100.0 + i, args=(i,)))
+
+    summaries = rate_limit.flush(160.0)
+    assert [summary.suppressed for summary in summaries] == [3]
+    assert summaries[0].getMessage() == "3 similar messages suppressed, last one: Access from 3"
+    assert (summaries[0].name, summaries[0].levelno, summaries[0].lineno) == ("ovpn_bot.bot", logging.INFO, 10)
+    assert rate_limit.flush(1000.0) == []
+    # Summary itself isn't limited, and call site starts a new window
+    assert rate_limit.filter(summaries[0])
+    assert rate_limit.filter(make_record(161.0))
+
+
+def test_count_of_window_expired_before_flush_is_kept():
+    rate_limit = RateLimitFilter(60.0, 1)
+    for i in range(3):
+        rate_limit.filter(make_record(100.0 + i))
+    assert rate_limit.filter(make_record(200.0))
+
+    assert [summary.suppressed for summary in rate_limit.flush(200.0)] == [2]
+
+
+def test_errors_are_never_suppressed_or_counted():
+    rate_limit = RateLimitFilter(60.0, 1)
+    assert all(rate_limit.filter(make_record(100.0 + i, level=logging.ERROR)) for i in range(5))
+    assert rate_limit.flush(0.0, force=True) == []
+
+
+def test_listener_reports_suppressed_count_when_flood_stops_and_on_stop():
+    queue = SimpleQueue()
+    handler = CollectingHandler()
+    listener = LogListener(queue, handler, flush_interval=0.01)
+    listener.set_rate_limit(RateLimitFilter(0.1, 2))
+    queue_handler = LocalQueueHandler(queue)
+    listener.start()
+    try:
+        for i in range(5):
+            queue_handler.handle(make_record(time(), args=(i,)))
+        deadline = time() + 5.0
+        while len(handler.records) < 3 and time() < deadline:
+            sleep(0.01)
+        assert [getattr(record, "suppressed", None) for record in handler.records] == [None, None, 3]
+
+        for i in range(4):
+            queue_handler.handle(make_record(time(), lineno=20, args=(i,)))
+    finally:
+        listener.stop()
+    assert [getattr(record, "suppressed", None) for record in handler.records[3:]] == [None, None, 2]
+
+
+def test_queue_handler_leaves_formatting_to_listener():
+    queue = SimpleQueue()
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = make_record(time(), level=logging.WARNING, exc_info=sys.exc_info())
+    LocalQueueHandler(queue).handle(record)
+
+    queued = queue.get_nowait()
+    assert (queued.msg, queued.args) == ("Access from %s", (1,))
+    assert queued.exc_info is not None and queued.exc_text is None
+
+
+def test_json_formatter_fields():
+    record = make_record(0.0, level=logging.WARNING, args=(42,))
+    record.update_id, record.user_id = 7, None
+
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry == {
+        "time": "1970-01-01T00:00:00+00:00",
+        "level": "WARNING",
+        "logger": "ovpn_bot.bot",
+        "message": "Access from 42",
+        "update_id": 7,
+    }
+
+
+def test_json_formatter_includes_suppressed_count_and_exception():
+    rate_limit = RateLimitFilter(1.0, 1)
+    for i in range(3):
+        rate_limit.filter(make_record(0.0))
+    assert json.loads(JsonFormatter().format(rate_limit.flush(2.0)[0]))["suppressed"] == 2
+
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = make_record(0.0, level=logging.ERROR, exc_info=sys.exc_info())
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["exception"].startswith("Traceback") and "ValueError: boom" in entry["exception"]
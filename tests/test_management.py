@@ -0,0 +1,95 @@
+import os
+from asyncio import run, start_unix_server, ensure_future, gather, sleep
+from datetime import datetime, timezone
+
+from ovpn_bot.management import ManagementPoller, StatusParser
+
+STATUS_FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "management_status_3.txt")
+
+
+# Replays recorded "status 3" output the way OpenVPN management interface does
+class FakeManagementServer:
+    def __init__(self, path: str, password: str):
+        self.path = path
+        self.password = password
+        self.received_passwords = []
+        self.status_requests = 0
+        self.__server = None
+        self.__writers = []
+        with open(STATUS_FIXTURE, "rb") as file:
+            self.__status = file.read()
+
+    async def start(self):
+        self.__server = await start_unix_server(self.__handle, self.path)
+
+    async def stop(self):
+        self.__server.close()
+        await self.__server.wait_closed()
+        for writer in self.__writers:
+            writer.close()
+
+    async def __handle(self, reader, writer):
+        self.__writers.append(writer)
+        writer.write(b"ENTER PASSWORD:")
+        self.received_passwords.append((await reader.readline()).decode("utf-8").rstrip("\n"))
+        writer.write(b"SUCCESS: password is correct\r\n")
+        writer.write(b">INFO:OpenVPN Management Interface Version 1 -- type 'help' for more info\r\n")
+        while True:
+            command = await reader.readline()
+            if not command:
+                break
+            if command.strip() == b"status 3":
+                self.status_requests += 1
+                writer.write(self.__status)
+            else:
+                writer.write(b"ERROR: unknown command, enter 'help' for more options\r\n")
+            await writer.drain()
+
+
+async def wait_until(condition, timeout: float = 5.0):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await sleep(0.01)
+    raise AssertionError("Condition wasn't met in time")
+
+
+def test_status_parser_reads_clients_by_header_columns():
+    parser = StatusParser()
+    with open(STATUS_FIXTURE, "r", newline="") as file:
+        finished = [parser.feed(line.rstrip("\r\n")) for line in file]
+
+    assert finished[-1] and not any(finished[:-1])
+    client = parser.clients["123456789 Phone"]
+    assert client.real_address == "203.0.113.7:51234"
+    assert client.virtual_address == "10.8.0.6"
+    assert client.bytes_received == 1843210
+    assert client.bytes_sent == 20571345
+    assert client.connected_since == datetime(2026, 10, 18, 17, 2, 11, tzinfo=timezone.utc)
+
+
+def test_poller_fills_clients_and_clears_them_on_disconnect(tmp_path):
+    server = FakeManagementServer(str(tmp_path / "openvpn.sock"), "secret")
+    poller = ManagementPoller(None, 7505, server.path, "secret", 0.05, 1.0)
+
+    async def scenario():
+        await server.start()
+        task = ensure_future(poller.run())
+        try:
+            await wait_until(lambda: poller.is_available)
+            assert server.received_passwords == ["secret"]
+            assert set(poller.clients) == {"123456789 Phone", "123456789 Laptop :laptop:"}
+            assert poller.get_client("123456789 Laptop :laptop:").bytes_sent == 310442
+
+            await wait_until(lambda: server.status_requests >= 3)
+            assert poller.is_available
+
+            await server.stop()
+            await wait_until(lambda: not poller.is_available)
+            assert poller.clients == {}
+            assert poller.updated_at is None
+        finally:
+            task.cancel()
+            await gather(task, return_exceptions=True)
+
+    run(scenario())
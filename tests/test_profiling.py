@@ -0,0 +1,63 @@
+import logging
+from asyncio import run, sleep, ensure_future, gather
+from unittest.mock import Mock
+
+import pytest
+from aiohttp.test_utils import make_mocked_request
+
+from ovpn_bot.profiling import Profiler, ProfilerError, SlowCallbackCollector
+
+
+def test_sampling_profile_writes_collapsed_stacks(tmp_path):
+    profiler = Profiler(str(tmp_path), 0.005, 0.1, 60)
+
+    async def profile():
+        return await profiler.start(0.2, "sampling")
+
+    result = run(profile())
+    assert result.samples > 0
+    assert result.files == [str(next(tmp_path.glob("sampling-*.collapsed")))]
+    assert not profiler.is_running
+
+
+def test_profile_is_rejected_while_running(tmp_path):
+    profiler = Profiler(str(tmp_path), 0.005, 0.1, 60)
+
+    async def profile():
+        running = profiler.start(0.1, "cprofile")
+        with pytest.raises(ProfilerError):
+            profiler.start(0.1, "sampling")
+        await running
+
+    run(profile())
+    assert list(tmp_path.glob("cprofile-*.pstats"))
+
+
+def test_profile_endpoint_survives_handler_cancellation(tmp_path):
+    profiler = Profiler(str(tmp_path), 0.005, 0.1, 60)
+    handler = profiler.routes()[0].handler
+    transport = Mock()
+    transport.get_extra_info.return_value = ("127.0.0.1", 50000)
+
+    async def profile():
+        # aiohttp cancels handler when client disconnects
+        request = make_mocked_request("POST", "/profile?seconds=0.3&mode=sampling", transport=transport)
+        response = ensure_future(handler(request))
+        await sleep(0.1)
+        response.cancel()
+        await gather(response, return_exceptions=True)
+        await sleep(0.5)
+
+    run(profile())
+    assert list(tmp_path.glob("sampling-*.collapsed"))
+
+
+def test_slow_callback_collector_accepts_non_string_messages():
+    collector = SlowCallbackCollector()
+    for msg, args in ((ConnectionResetError("reset by peer"), ()),
+                      ("Executing %s took %.3f seconds", ("<Task pending name='poll'>", 0.25)),
+                      ("Unrelated warning", ())):
+        collector.handle(logging.LogRecord("asyncio", logging.WARNING, "base_events.py", 1, msg, args, None))
+
+    assert [message.split(" ", 1)[1] for message in collector.messages] == [
+        "Executing <Task pending name='poll'> took 0.250 seconds"]
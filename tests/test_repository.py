@@ -0,0 +1,83 @@
+from asyncio import run
+from uuid import uuid4
+
+import pytest
+
+from ovpn_bot.service import VPNService, VPNSettings
+
+
+async def create_devices(repository, user_id: int, count: int):
+    devices = []
+    for index in range(count):
+        cert_sn = await repository.next_cert_sn()
+        devices.append(await repository.create(user_id, f"device {index}", b"pkey", b"cert_req", b"cert", cert_sn))
+    return devices
+
+
+async def remove_devices(repository, user_id: int, devices):
+    for device in devices:
+        await repository.remove(user_id, device.id)
+
+
+def page_ids(devices):
+    return [device.id for device in devices]
+
+
+def test_list_page_walks_keyset_in_both_directions(open_repository, user_id):
+    async def scenario():
+        async with open_repository() as repository:
+            devices = await create_devices(repository, user_id, 5)
+            try:
+                await repository.remove(user_id, devices[2].id)
+                ids = page_ids(devices[:2] + devices[3:])
+
+                first = await repository.list_page(user_id, None, True, 2)
+                second = await repository.list_page(user_id, first[-1].id, True, 2)
+                third = await repository.list_page(user_id, second[-1].id, True, 2)
+                back = await repository.list_page(user_id, second[0].id, False, 2)
+                last = await repository.list_page(user_id, None, False, 3)
+                return ids, [page_ids(page) for page in (first, second, third, back, last)]
+            finally:
+                await remove_devices(repository, user_id, devices)
+
+    ids, (first, second, third, back, last) = run(scenario())
+    assert first == ids[:2]
+    assert second == ids[2:4]
+    assert third == []
+    assert back == ids[:2]
+    # Backward request without cursor returns last page in ascending order
+    assert last == ids[-3:]
+
+
+def test_list_page_of_user_without_devices_is_empty(open_repository, user_id):
+    async def scenario():
+        async with open_repository() as repository:
+            return [await repository.list_page(user_id, None, forward, 10) for forward in (True, False)]
+
+    assert run(scenario()) == [[], []]
+
+
+# Unknown cursor yields nothing, the same as a cursor device that was archived
+class PagedRepository:
+    def __init__(self, ids):
+        self.ids = ids
+
+    async def list_page(self, user_id, cursor, forward, limit):
+        if cursor is None:
+            return self.ids[:limit] if forward else self.ids[-limit:]
+        if cursor not in self.ids:
+            return []
+        position = self.ids.index(cursor)
+        return self.ids[position + 1:position + 1 + limit] if forward else self.ids[max(position - limit, 0):position]
+
+
+@pytest.mark.parametrize("forward,expected", [(True, slice(None, 2)), (False, slice(-2, None))])
+def test_page_of_vanished_cursor_falls_back_to_first_or_last_page(forward, expected):
+    ids = [uuid4() for _ in range(5)]
+    config = {"database": {}, "servers": [], "server": {}, "management": {}, "balancing": {}}
+    service = VPNService(PagedRepository(ids), VPNSettings(None, 6, None), None, config)
+
+    page = run(service.list_devices_page(1, uuid4(), forward, 2))
+    assert page.devices == ids[expected]
+    # Page is rendered as if it was requested without cursor
+    assert (page.has_prev, page.has_next) == ((False, True) if forward else (True, False))
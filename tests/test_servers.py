@@ -0,0 +1,175 @@
+from asyncio import run, sleep, Event
+from datetime import datetime, timezone
+from typing import NamedTuple
+from uuid import uuid4
+
+from ovpn_bot import service
+from ovpn_bot.management import ClientStatus
+from ovpn_bot.servers import VPNServer, ServerPool, create_server_pool
+from ovpn_bot.service import VPNService, VPNSettings
+
+MANAGEMENT_DISABLED = {"host": None, "port": 7505, "socket": None, "password": None, "interval": 10.0, "timeout": 5.0}
+
+
+class FakePoller:
+    def __init__(self, clients: int = 0, is_available: bool = True):
+        self.is_available = is_available
+        self.updated_at = None
+        self.clients = {}
+        self.started = None
+        self.stopped = False
+        self.report(clients)
+
+    def report(self, clients: int):
+        self.clients = {
+            f"client {index}": ClientStatus(f"client {index}", "", "", 0, 0, datetime.now(timezone.utc))
+            for index in range(clients)}
+        self.updated_at = datetime.now(timezone.utc)
+
+    def get_client(self, common_name: str):
+        return self.clients.get(common_name)
+
+    async def run(self):
+        self.started.set()
+        try:
+            await sleep(3600)
+        finally:
+            self.stopped = True
+
+
+def server(host: str, weight: float = 1.0, region=None, poller=None) -> VPNServer:
+    return VPNServer(host, 1443, weight, region, poller)
+
+
+def hosts(servers) -> list:
+    return [server.host for server in servers]
+
+
+def test_servers_are_ordered_by_health_and_weighted_load():
+    pool = ServerPool([
+        server("down", weight=10.0, poller=FakePoller(0, is_available=False)),
+        server("busy", weight=1.0, poller=FakePoller(4)),
+        server("big", weight=4.0, poller=FakePoller(8)),
+        server("unmanaged"),
+        server("disabled", weight=0.0, poller=FakePoller(0)),
+    ], False)
+
+    # Unhealthy server goes last, the others by clients per unit of weight
+    assert hosts(pool.ordered_servers()) == ["unmanaged", "big", "busy", "disabled", "down"]
+
+
+def test_order_is_cached_until_some_poller_reports_new_status():
+    first, second = FakePoller(1), FakePoller(2)
+    pool = ServerPool([server("first", poller=first), server("second", poller=second)], False)
+    ordered = pool.ordered_servers()
+    assert hosts(ordered) == ["first", "second"]
+
+    # Status changed without a new report isn't picked up
+    first.clients = {str(index): None for index in range(5)}
+    assert pool.ordered_servers() is ordered
+
+    first.report(5)
+    assert hosts(pool.ordered_servers()) == ["second", "first"]
+
+
+def config(servers=(), server_host="vpn.example.com", management=None) -> dict:
+    return {
+        "servers": list(servers),
+        "server": {"host": server_host, "port": 1443},
+        "management": management or MANAGEMENT_DISABLED,
+        "balancing": {"remote_random": False},
+        "database": {"backend": "aiopg"},
+        "default": {"max_devices": 6},
+    }
+
+
+def test_single_server_falls_back_to_server_and_management_blocks():
+    management = {**MANAGEMENT_DISABLED, "socket": "/run/management/openvpn.sock", "password": "secret"}
+    pool = create_server_pool(config(management=management))
+
+    [single] = pool.ordered_servers()
+    assert (single.host, single.port, single.weight, single.region) == ("vpn.example.com", 1443, 1.0, None)
+    assert single.management_poller is not None
+
+
+def test_servers_list_takes_precedence_over_server_block():
+    pool = create_server_pool(config(servers=[
+        {"host": "eu.example.com", "port": 443, "weight": 2.0, "region": "eu", "management": MANAGEMENT_DISABLED},
+        {"host": "us.example.com", "port": 1443, "weight": 1.0, "region": "us", "management": MANAGEMENT_DISABLED},
+    ]))
+
+    assert [(server.host, server.region) for server in pool.ordered_servers()] == [
+        ("eu.example.com", "eu"), ("us.example.com", "us")]
+    assert all(server.management_poller is None for server in pool.ordered_servers())
+
+
+class FakeCertManager:
+    def dump_ca(self):
+        return "ca"
+
+    def dump_tls_auth(self):
+        return "tls-auth"
+
+
+class FakeDevice(NamedTuple):
+    id: object
+    user_id: int
+    name: str
+    cert_pem: str = "cert"
+    pkey_pem: str = "pkey"
+
+
+class FakeRepository:
+    def __init__(self, device):
+        self.device = device
+
+    async def get(self, user_id, device_id):
+        return self.device
+
+
+class FakeAuditLog:
+    def record(self, user_id, action, device_id=None, **details):
+        pass
+
+
+def remote_lines(content: bytes) -> list:
+    return [line.strip() for line in content.decode("utf-8").splitlines() if line.strip().startswith("remote ")]
+
+
+def test_server_pool_is_started_explicitly_and_replaced_on_reload(monkeypatch):
+    device = FakeDevice(uuid4(), 1, "Phone")
+    initial_config = config(servers=[
+        {"host": "eu.example.com", "port": 1443, "weight": 1.0, "region": "eu", "management": MANAGEMENT_DISABLED}])
+
+    async def load_cert_manager(config):
+        return FakeCertManager()
+
+    monkeypatch.setattr(service, "load_cert_manager", load_cert_manager)
+
+    async def scenario():
+        poller = FakePoller()
+        poller.started = Event()
+        pool = ServerPool([server("eu.example.com", region="eu", poller=poller)], False)
+        vpn_service = VPNService(
+            FakeRepository(device), VPNSettings(FakeCertManager(), 6, pool), FakeAuditLog(), initial_config)
+        await sleep(0)
+        constructed_started = poller.started.is_set()
+        vpn_service.start()
+        await poller.started.wait()
+
+        # Unchanged servers config keeps pool, so its cached order and pollers survive reload
+        await vpn_service.reload(initial_config)
+        kept = remote_lines((await vpn_service.generate_device_config(1, device.id)).getvalue())
+
+        await vpn_service.reload(config(servers=[
+            {"host": "us.example.com", "port": 443, "weight": 1.0, "region": "us", "management": MANAGEMENT_DISABLED},
+            {"host": "eu.example.com", "port": 1443, "weight": 1.0, "region": "eu", "management": MANAGEMENT_DISABLED}]))
+        replaced = remote_lines((await vpn_service.generate_device_config(1, device.id)).getvalue())
+        await vpn_service.close()
+        return constructed_started, kept, replaced, poller.stopped
+
+    constructed_started, kept, replaced, old_poller_stopped = run(scenario())
+    assert not constructed_started
+    assert kept == ["remote eu.example.com 1443 # eu"]
+    assert replaced == ["remote us.example.com 443 # us", "remote eu.example.com 1443 # eu"]
+    assert old_poller_stopped
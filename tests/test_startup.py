@@ -0,0 +1,47 @@
+from asyncio import run, sleep, CancelledError
+
+import pytest
+
+from ovpn_bot.startup import StartupTimings, gather_fail_fast
+
+
+def test_gather_fail_fast_returns_results_in_order():
+    async def value(result, delay):
+        await sleep(delay)
+        return result
+
+    assert run(gather_fail_fast(value(1, 0.02), value(2, 0), value(3, 0.01))) == [1, 2, 3]
+
+
+def test_gather_fail_fast_reraises_error_and_cancels_pending():
+    cancelled = []
+
+    async def slow():
+        try:
+            await sleep(10)
+        except CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def boom():
+        await sleep(0)
+        raise FileNotFoundError("certs/ca.crt")
+
+    with pytest.raises(FileNotFoundError, match="certs/ca.crt"):
+        run(gather_fail_fast(slow(), boom()))
+    assert cancelled == [True]
+
+
+def test_startup_timings_records_phases(caplog):
+    timings = StartupTimings()
+
+    async def startup():
+        with timings.phase("config"):
+            pass
+        return await timings.timed("database", sleep(0.01, result="pool"))
+
+    assert run(startup()) == "pool"
+    with caplog.at_level("INFO"):
+        timings.report()
+    assert "config" in caplog.text
+    assert "database 0.0" in caplog.text
@@ -0,0 +1,135 @@
+from asyncio import run
+from threading import Event
+
+import pytest
+
+from ovpn_bot import tracing
+from ovpn_bot.tracing import SpanExporter, Tracer, trace, span, traced
+
+
+class CollectingExporter(SpanExporter):
+    def __init__(self):
+        self.spans = []
+        self.closed = False
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+    def close(self):
+        self.closed = True
+
+
+class BlockingExporter(CollectingExporter):
+    def __init__(self):
+        super(BlockingExporter, self).__init__()
+        self.entered = Event()
+        self.released = Event()
+
+    def export(self, spans):
+        self.entered.set()
+        self.released.wait(5.0)
+        super(BlockingExporter, self).export(spans)
+
+
+def install_tracer(monkeypatch, sample_rate: float = 1.0):
+    exporter = CollectingExporter()
+    tracer = Tracer(exporter, sample_rate, 100)
+    monkeypatch.setattr(tracing, "_tracer", tracer)
+    return tracer, exporter
+
+
+@traced("sync call")
+def sync_call():
+    return "sync"
+
+
+@traced("async call")
+async def async_call():
+    return "async"
+
+
+def test_spans_form_parent_child_chain(monkeypatch):
+    tracer, exporter = install_tracer(monkeypatch)
+
+    async def scenario():
+        with trace("update", user_id=1) as root:
+            with span("query") as child:
+                child.set_attribute("rows", 2)
+                result = sync_call(), await async_call()
+        return root, result
+
+    root, result = run(scenario())
+    tracer.close()
+
+    assert result == ("sync", "async")
+    spans = {exported.name: exported for exported in exporter.spans}
+    assert set(spans) == {"update", "query", "sync call", "async call"}
+    assert {exported.trace_id for exported in exporter.spans} == {root.trace_id}
+    assert spans["update"].parent_id is None
+    assert spans["update"].attributes == {"user_id": 1}
+    assert spans["query"].parent_id == spans["update"].span_id
+    assert spans["query"].attributes == {"rows": 2}
+    assert spans["sync call"].parent_id == spans["query"].span_id
+    assert spans["async call"].parent_id == spans["query"].span_id
+    assert all(exported.end >= exported.start for exported in exporter.spans)
+    assert exporter.closed
+
+
+def test_error_is_recorded_on_span(monkeypatch):
+    tracer, exporter = install_tracer(monkeypatch)
+    with pytest.raises(ValueError):
+        with trace("update"):
+            raise ValueError("boom")
+    tracer.close()
+
+    [exported] = exporter.spans
+    assert exported.error == "ValueError('boom')"
+
+
+def test_unsampled_and_untraced_calls_create_no_spans(monkeypatch):
+    tracer, exporter = install_tracer(monkeypatch, sample_rate=0.0)
+
+    # Children of unsampled root aren't recorded either
+    with trace("update") as root:
+        with span("query") as child:
+            assert sync_call() == "sync"
+    assert root is child is tracing._NOOP_SPAN
+    # Without current span traced functions and spans are noop
+    assert span("query") is tracing._NOOP_SPAN
+    assert run(async_call()) == "async"
+    tracer.close()
+
+    assert exporter.spans == []
+
+
+@pytest.mark.parametrize("sample_rate,expected", [(0.0, False), (0.25, False), (0.5, True), (1.0, True)])
+def test_sampling_decision(monkeypatch, sample_rate, expected):
+    monkeypatch.setattr(tracing, "random", lambda: 0.3)
+    tracer = Tracer(CollectingExporter(), sample_rate, 100)
+    try:
+        assert tracer.is_sampled() is expected
+    finally:
+        tracer.close()
+
+
+def tracer_span(tracer: Tracer):
+    return tracing._span_scope(tracer, tracing.Span("0" * 32, None, "update", {}))
+
+
+def test_spans_are_dropped_when_queue_is_full():
+    exporter = BlockingExporter()
+    tracer = Tracer(exporter, 1.0, 2)
+    # Exporter thread takes the first span and blocks on export
+    with tracer_span(tracer):
+        pass
+    assert exporter.entered.wait(5.0)
+
+    for _ in range(5):
+        with tracer_span(tracer):
+            pass
+    assert tracer.dropped == 3
+
+    exporter.released.set()
+    tracer.close()
+    assert len(exporter.spans) == 3
+    assert tracer.dropped == 3
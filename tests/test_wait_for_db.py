@@ -0,0 +1,82 @@
+from asyncio import run, TimeoutError as AsyncTimeoutError
+
+import asyncpg
+import pytest
+
+from ovpn_bot import service
+
+
+def test_wait_for_db_backs_off_exponentially(monkeypatch):
+    attempts = []
+    delays = []
+
+    async def probe_db(db_config):
+        attempts.append(True)
+        if len(attempts) < 5:
+            raise ConnectionRefusedError()
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(service, "probe_db", probe_db)
+    monkeypatch.setattr(service, "sleep", sleep)
+    monkeypatch.setattr(service, "uniform", lambda low, high: high)
+
+    run(service.wait_for_db({"backend": "aiopg", "wait": 10}))
+    assert len(attempts) == 5
+    assert delays == [0.1, 0.2, 0.4, 0.8]
+
+
+def test_wait_for_db_delay_is_capped_and_jittered(monkeypatch):
+    bounds = []
+
+    async def probe_db(db_config):
+        if len(bounds) < 10:
+            raise ConnectionRefusedError()
+
+    async def sleep(delay):
+        pass
+
+    def uniform(low, high):
+        bounds.append((low, high))
+        return low
+
+    monkeypatch.setattr(service, "probe_db", probe_db)
+    monkeypatch.setattr(service, "sleep", sleep)
+    monkeypatch.setattr(service, "uniform", uniform)
+
+    run(service.wait_for_db({"backend": "aiopg", "wait": 10}))
+    assert all(low == 0 for low, high in bounds)
+    assert bounds[-1][1] == service.DB_WAIT_BACKOFF_MAX
+
+
+def test_wait_for_db_times_out_with_last_error(monkeypatch):
+    async def probe_db(db_config):
+        raise ConnectionRefusedError("database is down")
+
+    monkeypatch.setattr(service, "probe_db", probe_db)
+
+    with pytest.raises(TimeoutError) as error:
+        run(service.wait_for_db({"backend": "aiopg", "wait": 0.3}))
+    assert isinstance(error.value.__cause__, ConnectionRefusedError)
+
+
+def test_wait_for_db_retries_connect_timeouts_and_asyncpg_errors(monkeypatch):
+    errors = [AsyncTimeoutError(), asyncpg.CannotConnectNowError("the database system is starting up"),
+              asyncpg.InterfaceError("connection was closed")]
+
+    for backend in ("aiopg", "asyncpg"):
+        pending = list(errors[:1] if backend == "aiopg" else errors)
+
+        async def probe_db(db_config):
+            if pending:
+                raise pending.pop(0)
+
+        async def sleep(delay):
+            pass
+
+        monkeypatch.setattr(service, "probe_db", probe_db)
+        monkeypatch.setattr(service, "sleep", sleep)
+
+        run(service.wait_for_db({"backend": backend, "wait": 10}))
+        assert pending == []